@@ -0,0 +1,276 @@
+import klayout.db as kdb
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+
+from output import fork_context
+from pdk import LAYERS
+
+LAYOUT_SUFFIXES = (".gds", ".gds.gz", ".oas")
+
+
+def _name(info: kdb.LayerInfo) -> str:
+    for layer in LAYERS:
+        if (layer.layer, layer.datatype) == (info.layer, info.datatype):
+            return str(layer)
+    return f"{info.layer}_{info.datatype}"
+
+
+def _fingerprint(cell: kdb.Cell, layer: int, cache: dict[tuple[int, int], str]) -> str:
+    # sha256 of the shapes of one layer below a cell, by child fingerprint and
+    # placement so shared cells are hashed once
+    key = (cell.cell_index(), layer)
+    if key in cache:
+        return cache[key]
+
+    layout = cell.layout()
+    h = hashlib.sha256()
+    for item in sorted(str(shape) for shape in cell.shapes(layer).each()):
+        h.update(f"{item}\n".encode())
+
+    instances = []
+    for inst in cell.each_inst():
+        child = layout.cell(inst.cell_index)
+        if child.bbox(layer).empty():
+            continue
+        array = inst.cell_inst
+        instances.append(
+            f"I{_fingerprint(child, layer, cache)} "
+            f"{array.cplx_trans} {array.a} {array.b} {array.na} {array.nb}"
+        )
+    for item in sorted(instances):
+        h.update(f"{item}\n".encode())
+
+    cache[key] = h.hexdigest()
+    return cache[key]
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _clipped(top: kdb.Cell, layer: int, tiles: kdb.Region) -> str:
+    # sha256 of the flat shapes of one layer outside of the tiles
+    h = hashlib.sha256()
+    region = kdb.Region(top.begin_shapes_rec(layer)) - tiles
+    for item in sorted(str(polygon) for polygon in region.each()):
+        h.update(f"{item}\n".encode())
+    return h.hexdigest()
+
+
+def entry(
+    path: str,
+    labels: list[tuple[tuple[float, float], tuple[float, float]]] = (),
+) -> dict:
+    # content hash of a file, and of each layer of the top cell for layouts.
+    # With labels, the tiles ((LEFT, BOTTOM), (RIGHT, TOP)) of the top cell that
+    # hold the version label, layouts also get a "content" hash of every layer
+    # outside of the tiles
+    result = {"sha256": _hash_file(path)}
+    if path.endswith(LAYOUT_SUFFIXES):
+        layout = kdb.Layout()
+        layout.read(path)
+        top = layout.top_cell()
+        cache = {}
+        layers = [
+            layer
+            for layer in sorted(
+                layout.layer_indexes(), key=lambda i: str(layout.get_info(i))
+            )
+            if not top.bbox(layer).empty()
+        ]
+        result["layers"] = {
+            _name(layout.get_info(layer)): _fingerprint(top, layer, cache)
+            for layer in layers
+        }
+
+        if labels:
+            tiles = kdb.Region()
+            for tile in labels:
+                tiles.insert(kdb.DBox(*tile[0], *tile[1]).to_itype(layout.dbu))
+
+            h = hashlib.sha256()
+            for layer in layers:
+                name = _name(layout.get_info(layer))
+                fingerprint = result["layers"][name]
+                # only layers reaching into a tile are flattened
+                if top.bbox(layer).overlaps(tiles.bbox()):
+                    fingerprint = _clipped(top, layer, tiles)
+                h.update(f"{name} {fingerprint}\n".encode())
+            result["content"] = h.hexdigest()
+    return result
+
+
+def manifest(
+    paths: list[str],
+    version: str,
+    labels: dict[str, list] | None = None,
+    workers: int | None = None,
+) -> dict:
+    # artifacts are keyed without the "mega_pc_{version}_" prefix, so manifests
+    # of different versions line up, each file is hashed in a forked worker.
+    # labels holds the label tiles of the layouts that carry the version label,
+    # see entry
+    prefix = f"mega_pc_{version}_"
+    paths = sorted(paths)
+    labels = labels or {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=fork_context(),
+    ) as executor:
+        entries = list(
+            executor.map(entry, paths, [labels.get(path, ()) for path in paths])
+        )
+
+    artifacts = {}
+    for path, result in zip(paths, entries):
+        name = os.path.basename(path)
+        key = name[len(prefix) :] if name.startswith(prefix) else name
+        artifacts[key] = {"file": name, **result}
+
+    return {"version": version, "artifacts": artifacts}
+
+
+def write(path: str, data: dict) -> None:
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(old: dict, new: dict) -> dict[str, list[str]]:
+    # artifact keys by status, changed artifacts list their changed layers
+    # as "KEY: LAYER, LAYER". Relabeled artifacts differ only within their label
+    # tiles
+    old_artifacts = old["artifacts"]
+    new_artifacts = new["artifacts"]
+
+    result = {
+        "added": [],
+        "removed": [],
+        "changed": [],
+        "relabeled": [],
+        "unchanged": [],
+    }
+    for key in sorted(new_artifacts.keys() - old_artifacts.keys()):
+        result["added"].append(key)
+    for key in sorted(old_artifacts.keys() - new_artifacts.keys()):
+        result["removed"].append(key)
+
+    for key in sorted(new_artifacts.keys() & old_artifacts.keys()):
+        a, b = old_artifacts[key], new_artifacts[key]
+        if a["sha256"] == b["sha256"]:
+            result["unchanged"].append(key)
+            continue
+        if "content" in a and a.get("content") == b.get("content"):
+            result["relabeled"].append(key)
+            continue
+
+        old_layers, new_layers = a.get("layers", {}), b.get("layers", {})
+        layers = sorted(
+            layer
+            for layer in old_layers.keys() | new_layers.keys()
+            if old_layers.get(layer) != new_layers.get(layer)
+        )
+        result["changed"].append(f"{key}: {', '.join(layers)}" if layers else key)
+
+    return result
+
+
+def reuse(old: dict, new: dict) -> tuple[dict, list[str]]:
+    # unchanged artifacts keep the file of the release that uploaded it, so a
+    # chain of unchanged releases points at the first one, returns the new
+    # manifest and the files that still need to be uploaded. Relabeled
+    # artifacts are uploaded again, the old file carries the old version label
+    unchanged = set(compare(old, new)["unchanged"])
+    artifacts = {}
+    uploads = []
+    for key, value in new["artifacts"].items():
+        if key in unchanged:
+            previous = old["artifacts"][key]
+            value = {
+                **value,
+                "file": previous["file"],
+                "release": previous.get("release", old["version"]),
+            }
+        else:
+            uploads.append(value["file"])
+        artifacts[key] = value
+
+    return {**new, "artifacts": artifacts}, uploads
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build artifact manifests for MEGA-PC")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create = subparsers.add_parser("create", help="Write the manifest of files")
+    create.add_argument("output", help="Manifest JSON file to write")
+    create.add_argument("files", nargs="+", help="Artifacts to hash")
+    create.add_argument(
+        "--version",
+        action="store",
+        type=str,
+        help="Version in the artifact names",
+        required=True,
+    )
+    create.add_argument(
+        "--label-tile",
+        action="append",
+        type=float,
+        nargs=4,
+        help="LEFT BOTTOM RIGHT TOP of a label tile of the layouts, can be repeated",
+        default=[],
+    )
+
+    for command, help in [
+        ("compare", "Print the added, removed, changed and unchanged artifacts"),
+        (
+            "reuse",
+            "Point the unchanged artifacts of NEW at the release holding their file, "
+            "and print the files of NEW to upload",
+        ),
+    ]:
+        subparser = subparsers.add_parser(command, help=help)
+        subparser.add_argument("old", help="Manifest of the previous release")
+        subparser.add_argument("new", help="Manifest of this build")
+
+    files = subparsers.add_parser("files", help="Print the files of a manifest")
+    files.add_argument("manifest", help="Manifest JSON file")
+
+    args = parser.parse_args()
+
+    if args.command == "create":
+        tiles = [((l, b), (r, t)) for l, b, r, t in args.label_tile]
+        write(
+            args.output,
+            manifest(args.files, args.version, {path: tiles for path in args.files}),
+        )
+    elif args.command == "files":
+        directory = os.path.dirname(args.manifest)
+        for value in load(args.manifest)["artifacts"].values():
+            print(os.path.join(directory, value["file"]))
+    elif args.command == "compare":
+        for status, keys in compare(load(args.old), load(args.new)).items():
+            for key in keys:
+                print(f"{status.upper()} {key}")
+    else:
+        new, uploads = reuse(load(args.old), load(args.new))
+        write(args.new, new)
+        directory = os.path.dirname(args.new)
+        for file in uploads:
+            print(os.path.join(directory, file))
+
+    sys.exit(0)
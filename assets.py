@@ -0,0 +1,65 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import functools
+import os
+
+
+@functools.cache
+def _library(path: str, mtime: float) -> kdb.Layout:
+    layout = kdb.Layout()
+    layout.read(path)
+    return layout
+
+
+@functools.cache
+def _symbol(
+    path: str,
+    cell: str,
+    mtime: float,
+    layer_map: tuple[tuple[gf.typings.Layer, gf.typings.Layer], ...],
+) -> gf.Component:
+    source = _library(path, mtime).cell(cell)
+    if source is None:
+        raise ValueError(f"Cell '{cell}' not found in {path}")
+
+    c = gf.Component()
+    c.kdb_cell.copy_tree(source)
+    c.remap_layers(dict(layer_map), recursive=True)
+    # one cell per layer map, like the cache
+    c.name = "_".join(
+        [cell]
+        + [
+            "{}_{}_to_{}_{}".format(*gf.get_layer_tuple(a), *gf.get_layer_tuple(b))
+            for a, b in layer_map
+        ]
+    )
+
+    return c
+
+
+def symbol(
+    path: str,
+    cell: str,
+    layer_map: dict[gf.typings.Layer, gf.typings.Layer] | None = None,
+) -> gf.Component:
+    # the library is parsed once per file modification, each cell is copied and
+    # remapped once per layer map
+    return _symbol(
+        path,
+        cell,
+        os.path.getmtime(path),
+        tuple(sorted((layer_map or {}).items())),
+    )
+
+
+def place(
+    component: gf.Component,
+    symbol: gf.Component,
+    mag: float,
+    position: tuple[float, float],
+) -> gf.ComponentReference:
+    # scale through the reference, the symbol geometry is left untouched
+    ref = component << symbol
+    ref.dcplx_trans = kdb.DCplxTrans(mag, 0, False, *position)
+    return ref
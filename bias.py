@@ -0,0 +1,150 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import concurrent.futures
+import os
+import tempfile
+
+from output import fork_context
+
+# tiles are compensated independently, each sees its neighborhood up to the
+# widest class plus the largest bias (um)
+TILE_SIZE = 1000
+
+# component shared with forked workers
+_COMPONENT = None
+
+
+def bias(
+    region: kdb.Region,
+    table: list[tuple[float | None, float]],
+    dbu: float,
+) -> kdb.Region:
+    # moves each edge by the bias of the opening width it faces, table rows are
+    # (max width, bias) in um by ascending width, None as the last width covers
+    # everything wider, negative biases shrink the openings. The width check
+    # returns the parts of edges that face a narrow opening, so an edge can be
+    # split between classes, each part takes the bias of its own class and the
+    # larger bias reaches its own distance past the split
+    region = region.merged()
+    edges = region.edges()
+
+    # edges of all classes with the same bias are moved together
+    if len({distance for _, distance in table}) == 1:
+        classes = {table[0][1]: edges}
+    else:
+        classes = {}
+        narrower = kdb.Edges()
+        for width, distance in table:
+            if width is None:
+                selected = edges - narrower
+            else:
+                narrow = region.width_check(
+                    round(width / dbu), False, kdb.Metrics.Projection
+                ).edges()
+                selected = narrow - narrower
+                narrower += narrow
+            classes[distance] = classes.get(distance, kdb.Edges()) + selected
+
+    grow = kdb.Region()
+    shrink = kdb.Region()
+    for distance, selected in classes.items():
+        d = round(abs(distance) / dbu)
+        if d == 0 or selected.is_empty():
+            continue
+
+        # the band a uniform bias would add or remove, kept where it is next to
+        # the edges of this class, strips run past the edge ends to keep corners
+        near = selected.extended(d, d, d, d, False)
+        if distance > 0:
+            grow += (region.sized(d) - region) & near
+        else:
+            shrink += (region - region.sized(-d)) & near
+
+    return ((region - shrink) + grow).merged()
+
+
+def _border(table: list[tuple[float | None, float]]) -> float:
+    widths = [width for width, _ in table if width is not None]
+    return max(widths, default=0) + 2 * max(abs(distance) for _, distance in table)
+
+
+def _compensate_tile(
+    layer: int,
+    box: kdb.Box,
+    table: list[tuple[float | None, float]],
+    directory: str,
+    index: int,
+) -> str:
+    dbu = _COMPONENT.kcl.dbu
+    window = box.enlarged(round(_border(table) / dbu))
+    region = kdb.Region(
+        _COMPONENT.kdb_cell.begin_shapes_rec_overlapping(layer, window)
+    ) & kdb.Region(window)
+
+    result = bias(region, table, dbu) & kdb.Region(box)
+
+    layout = kdb.Layout()
+    layout.dbu = dbu
+    layout.create_cell("tile").shapes(layout.layer(0, 0)).insert(result)
+
+    path = os.path.join(directory, f"{layer}_{index}.oas")
+    layout.write(path)
+    return path
+
+
+def compensate(
+    component: gf.Component,
+    layers: list[gf.typings.Layer],
+    table: list[tuple[float | None, float]],
+    tile_size: float = TILE_SIZE,
+    workers: int | None = None,
+) -> None:
+    # width dependent bias of the layers of a flat component in place, tiles
+    # are spread over forked workers
+    global _COMPONENT
+    _COMPONENT = component
+
+    dbu = component.kcl.dbu
+    step = round(tile_size / dbu)
+    tasks = []
+    for layer in [gf.get_layer(layer) for layer in layers]:
+        box = component.kdb_cell.bbox(layer)
+        if box.empty():
+            continue
+
+        # tiles cover the bbox grown by the largest bias
+        box = box.enlarged(round(_border(table) / dbu))
+        for x in range(box.left, box.right, step):
+            for y in range(box.bottom, box.top, step):
+                tile = kdb.Box(x, y, min(x + step, box.right), min(y + step, box.top))
+                tasks.append((layer, tile))
+
+    with tempfile.TemporaryDirectory() as directory:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=fork_context(),
+        ) as executor:
+            paths = list(
+                executor.map(
+                    _compensate_tile,
+                    [layer for layer, _ in tasks],
+                    [tile for _, tile in tasks],
+                    [table] * len(tasks),
+                    [directory] * len(tasks),
+                    range(len(tasks)),
+                )
+            )
+
+        results = {}
+        for (layer, _), path in zip(tasks, paths):
+            layout = kdb.Layout()
+            layout.read(path)
+            results.setdefault(layer, kdb.Region()).insert(
+                kdb.Region(layout.top_cell().begin_shapes_rec(layout.layer(0, 0)))
+            )
+
+        for layer, region in results.items():
+            shapes = component.kdb_cell.shapes(layer)
+            shapes.clear()
+            shapes.insert(region.merged())
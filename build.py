@@ -1,16 +1,27 @@
 import gdsfactory as gf
-
-gf.clear_cache()
-
-
 import gfelib as gl
 import gfebuild as gb
+import kfactory as kf
+import klayout.db as kdb
 import sys
+import os
 import datetime
 import argparse
 
 from pdk import LAYERS, PDK
-from device import device, CHIP_SIZE, CAVITY_WIDTH
+from output import FORMATS, Writer, stem
+from geometry import insert, region
+from bias import compensate
+from labels import digest, load, patch
+from release import markers, simulate
+from preview import preview
+from reticle import assemble
+from artifacts import manifest, write as write_manifest
+from wafer import WAFER_DIAMETER, WAFER_ALIGNMENT_MARKS, compose, placements_text
+from wafer import load as load_sites
+from fracture import fracture, MAX_VERTICES
+from density import density, flagged, render
+import nets
 
 PDK.activate()
 
@@ -20,16 +31,96 @@ parser.add_argument(
     action="store_true",
     help="Don't merge the device patterns (e.g. release holes), because it can be very slow. For debug use only, ASML reticle files will not be generated",
 )
+parser.add_argument(
+    "--draft",
+    action="store_true",
+    help="Coarse arcs, release hole fields as DRAFT_RELEASE markers, gear teeth as their envelope and no logos, for floorplanning and connectivity review. The release check and ASML reticle files are skipped",
+)
 parser.add_argument(
     "--mirror",
     action="store_true",
     help="Write additional ASML reticle files that are mirrored across x=0 (PLACEMENTS file is not mirrored)",
 )
+parser.add_argument(
+    "--pack-reticles",
+    action="store_true",
+    help="Pack the ASML reticle images onto the fewest reticles, then with the fewest reticle swaps in process order, instead of the gb layout",
+)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="Rebuild the label-free layout even if a cached copy for the current sources exists",
+)
 parser.add_argument(
     "--show",
     action="store_true",
     help="Show the last pattern with KLayout",
 )
+parser.add_argument(
+    "--format",
+    action="store",
+    type=str,
+    choices=FORMATS,
+    help="Output format for all layout files, OASIS files use CBLOCK compression and repetition detection",
+    default="gds",
+)
+for artifact in ["source", "build", "reticle", "wafer"]:
+    parser.add_argument(
+        f"--{artifact}-format",
+        action="store",
+        type=str,
+        choices=FORMATS,
+        help=f"Output format for {artifact.upper()} layout files, overrides --format",
+        default=None,
+    )
+parser.add_argument(
+    "--max-vertices",
+    action="store",
+    type=int,
+    help="Split polygons of the BUILD, reticle and wafer files to at most this many vertices, 0 to disable",
+    default=MAX_VERTICES,
+)
+parser.add_argument(
+    "--density-window",
+    action="store",
+    type=float,
+    nargs=2,
+    help="Flag DENSITY_TILE_SIZE tiles of the DEVICE_REMOVE and HANDLE_REMOVE open area outside of [MIN, MAX]",
+    default=(0.1, 0.9),
+)
+parser.add_argument(
+    "--netlist",
+    action="store",
+    type=str,
+    help="JSON file mapping net names to the bond pads on each net, the build fails on opens and shorts",
+    default=None,
+)
+parser.add_argument(
+    "--sites",
+    action="store",
+    type=str,
+    help="JSON site map for mixed-design backside site plans (see wafer.py), this build is the MEGA_PC design",
+    default=None,
+)
+parser.add_argument(
+    "--preview",
+    action="store",
+    type=int,
+    help="Write PNG previews of each layer of the BUILD, reticle and wafer files at the given resolution (pixels)",
+    default=0,
+)
+parser.add_argument(
+    "--date",
+    action="store",
+    type=datetime.date.fromisoformat,
+    help="Date text in YYYY-MM-DD format, e.g. the commit date for reproducible builds",
+    default=datetime.date.today(),
+)
+parser.add_argument(
+    "--deterministic",
+    action="store_true",
+    help="Write byte-stable layout files without timestamps and with anonymous cells named after their geometry, so unchanged artifacts hash the same across builds",
+)
 parser.add_argument(
     "--version",
     action="store",
@@ -47,161 +138,252 @@ parser.add_argument(
 
 args = parser.parse_args()
 
-date_str = str(datetime.date.today())
+# the level of detail is fixed when device.py is first imported
+if args.draft:
+    os.environ["MEGA_PC_DRAFT"] = "1"
+
+from device import (
+    device,
+    device_unlabeled,
+    label,
+    CHIP_SIZE,
+    CAVITY_WIDTH,
+    LABEL_TILE,
+    RELEASE_SPEC,
+    SYMBOL_LIBRARY,
+    bond_pads,
+)
 
-WAFER_DIAMETER = 150000
-WAFER_ALIGNMENT_MARKS = [
-    (-40000, 2000),
-    (40000, 2000),
-    (-40000, -2000),
-    (40000, -2000),
-    (-8000, 48000),
-    (8000, 48000),
+for artifact in ["source", "build", "reticle", "wafer"]:
+    if getattr(args, f"{artifact}_format") is None:
+        setattr(args, f"{artifact}_format", args.format)
+
+date_str = str(args.date)
+
+# DRIE expands all features by 0.3 um
+DRIE_BIAS = -0.3
+
+# DRIE bias by opening width, (max width, bias) in um by ascending width, flat
+# at the nominal bias until calibrated against CD measurements
+DRIE_BIAS_TABLE = [
+    (4, DRIE_BIAS),  # comb gaps, RDRIVE_TEETH_CLEARANCE
+    (10, DRIE_BIAS),  # release holes
+    (None, DRIE_BIAS),  # trenches, CAVITY_WIDTH
+]
+
+# oxide undercut during release, must free everything within RELEASE_SPEC hole fields
+RELEASE_UNDERCUT = 6
+
+# everything that affects the label-free layout, used as the cache key
+SOURCES = [
+    "build.py",
+    "device.py",
+    "geometry.py",
+    "bias.py",
+    "pdk.py",
+    "assets.py",
+    SYMBOL_LIBRARY,
+    os.path.dirname(gl.__file__),
+    os.path.dirname(gb.__file__),
 ]
 
+# libraries whose output ends up in the label-free layout, part of the cache key
+VERSIONS = [gf.__version__, kf.__version__, kdb.__version__]
+
+# open area analysis for DRIE loading
+DENSITY_LAYERS = [LAYERS.DEVICE_REMOVE, LAYERS.HANDLE_REMOVE]
+DENSITY_TILE_SIZE = 250
+
 CHIP_RECT = gf.components.rectangle(
     size=(CHIP_SIZE, CHIP_SIZE),
     layer=LAYERS.DUMMY,
     centered=True,
 )
 
-d = device(text=f"{args.version}\n{args.hash[:7]}\n{date_str}")
+writer = Writer(deterministic=args.deterministic)
 
-d.write_gds(f"./build/mega_pc_{args.version}_SOURCE.gds")
+label_text = f"{args.version}\n{args.hash[:7]}\n{date_str}"
 
-c = gf.Component(name="chip")
+d = device(text=label_text)
 
-if not args.no_merge:
-    # DEVICE merged
-    _ = c << gf.boolean(
-        A=gf.boolean(
-            A=CHIP_RECT,
-            B=d,
-            operation="-",
-            layer=LAYERS.DUMMY,
-            layer1=LAYERS.DUMMY,
-            layer2=LAYERS.DEVICE,
-        ),
-        B=d,
-        operation="|",
-        layer=LAYERS.DEVICE_REMOVE,
-        layer1=LAYERS.DUMMY,
-        layer2=LAYERS.DEVICE_REMOVE,
-    )
+writer.write(
+    d,
+    f"./build/mega_pc_{args.version}_SOURCE",
+    format=args.source_format,
+    with_metadata=True,
+    deduplicate=True,
+)
+
+unlabeled_key = digest(SOURCES, *VERSIONS, str(args.no_merge), str(args.draft))
+unlabeled_path = f"./build/cache/mega_pc_{unlabeled_key}_UNLABELED"
+
+if os.path.exists(f"{unlabeled_path}.oas") and not args.no_cache:
+    c = load(f"{unlabeled_path}.oas", name="chip")
 else:
-    # DEVICE and DEVICE_REMOVE not merged
-    _ = c << d.extract(layers=[LAYERS.DEVICE, LAYERS.DEVICE_REMOVE])
-
-# HANDLE
-handle = gf.Component()
-
-for i in range(7, -1, -1):
-    handle = gf.boolean(
-        A=handle,
-        B=d,
-        operation="-",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=(LAYERS.HANDLE_P0[0], i),
-    )
+    d_unlabeled = device_unlabeled()
 
-    exp = gf.boolean(
-        A=gf.Component(),
-        B=d,
-        operation="|",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=(LAYERS.HANDLE_P0[0], i),
-    )
-    exp.offset(layer=LAYERS.DUMMY, distance=CAVITY_WIDTH)
-
-    border = gf.boolean(
-        A=exp,
-        B=d,
-        operation="-",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=(LAYERS.HANDLE_P0[0], i),
-    )
+    c = gf.Component(name="chip")
 
-    handle = gf.boolean(
-        A=handle,
-        B=border,
-        operation="|",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=LAYERS.DUMMY,
+    chip = region(CHIP_RECT, LAYERS.DUMMY)
+
+    if not args.no_merge:
+        # DEVICE merged
+        insert(
+            c,
+            LAYERS.DEVICE_REMOVE,
+            (chip - region(d_unlabeled, LAYERS.DEVICE))
+            | region(d_unlabeled, LAYERS.DEVICE_REMOVE),
+        )
+    else:
+        # DEVICE and DEVICE_REMOVE not merged
+        for layer in [LAYERS.DEVICE, LAYERS.DEVICE_REMOVE]:
+            insert(c, layer, region(d_unlabeled, layer))
+
+    # HANDLE
+    handle = kdb.Region()
+
+    for i in range(7, -1, -1):
+        pattern = region(d_unlabeled, (LAYERS.HANDLE_P0[0], i))
+        handle -= pattern
+        handle |= pattern.sized(c.kcl.to_dbu(CAVITY_WIDTH)) - pattern
+
+    insert(
+        c,
+        LAYERS.HANDLE_REMOVE,
+        handle | region(d_unlabeled, LAYERS.HANDLE_REMOVE),
     )
 
-_ = c << gf.boolean(
-    A=handle,
-    B=d,
-    operation="|",
-    layer=LAYERS.HANDLE_REMOVE,
-    layer1=LAYERS.DUMMY,
-    layer2=LAYERS.HANDLE_REMOVE,
+    # POSITIVE LAYERS
+    for layer in [
+        LAYERS.VIAS_ETCH,
+        LAYERS.CAP_TRENCH_ETCH,
+        LAYERS.CAP_BACKSIDE,
+    ]:
+        insert(c, layer, chip & region(d_unlabeled, layer))
+
+    # NEGATIVE LAYERS
+    for layer in [
+        LAYERS.POLY,
+        LAYERS.OXIDE,
+        LAYERS.NITRIDE,
+        LAYERS.CAP_OXIDE,
+        LAYERS.CAP_NITRIDE,
+    ]:
+        insert(c, layer, chip - region(d_unlabeled, layer))
+
+    # DRAFT MARKERS
+    if args.draft:
+        insert(c, LAYERS.DRAFT_RELEASE, region(d_unlabeled, LAYERS.DRAFT_RELEASE))
+
+    # PROCESS COMPENSATION
+    compensate(c, [LAYERS.DEVICE_REMOVE, LAYERS.HANDLE_REMOVE], DRIE_BIAS_TABLE)
+
+    c.flatten()
+
+    writer.write(c, unlabeled_path, format="oas")
+
+# version label is merged into the label-free layout within its own tile
+patch(
+    component=c,
+    overlay=label(label_text),
+    layer=LAYERS.DEVICE_REMOVE,
+    tile=LABEL_TILE,
+    bias=DRIE_BIAS,
 )
 
-
-# POSITIVE LAYERS
-for layer in [
-    LAYERS.VIAS_ETCH,
-    LAYERS.CAP_TRENCH_ETCH,
-    LAYERS.CAP_BACKSIDE,
-]:
-    _ = c << gf.boolean(
-        A=CHIP_RECT,
-        B=d,
-        operation="&",
-        layer=layer,
-        layer1=LAYERS.DUMMY,
-        layer2=layer,
+# RELEASE CHECK
+# drafts have no release holes
+if not args.draft:
+    unreleased, floating = simulate(
+        component=c,
+        device_layer=LAYERS.DEVICE,
+        remove_layer=LAYERS.DEVICE_REMOVE,
+        undercut=RELEASE_UNDERCUT,
+        hole_radius=RELEASE_SPEC.hole_radius,
+        hole_distance=RELEASE_SPEC.distance,
+        bias=DRIE_BIAS,
+        merged=not args.no_merge,
     )
-
-# NEGATIVE LAYERS
-for layer in [
-    LAYERS.POLY,
-    LAYERS.OXIDE,
-    LAYERS.NITRIDE,
-    LAYERS.CAP_OXIDE,
-    LAYERS.CAP_NITRIDE,
-]:
-    _ = c << gf.boolean(
-        A=CHIP_RECT,
-        B=d,
-        operation="-",
-        layer=layer,
-        layer1=LAYERS.DUMMY,
-        layer2=layer,
+    release_check = markers(
+        unreleased=unreleased,
+        floating=floating,
+        unreleased_layer=LAYERS.CHECK_UNRELEASED,
+        floating_layer=LAYERS.CHECK_FLOATING,
+    )
+    release_check.name = "release_check"
+    writer.write(
+        release_check,
+        f"./build/mega_pc_{args.version}_BUILD_RELEASE_CHECK",
+        format=args.build_format,
+    )
+    print(
+        f"RELEASE CHECK: {unreleased.count()} unreleased features, "
+        f"{floating.count()} undercut anchors"
     )
 
-# PROCESS COMPENSATION
-
-# DRIE expands all features by 0.3 um
-c.offset(layer=LAYERS.DEVICE_REMOVE, distance=-0.3)
-c.offset(layer=LAYERS.HANDLE_REMOVE, distance=-0.3)
-
-c.flatten()
-c.write_gds(f"./build/mega_pc_{args.version}_BUILD.gds", with_metadata=False)
+# CONNECTIVITY
+pad_nets = nets.chip(
+    component=c,
+    device_layer=LAYERS.DEVICE,
+    remove_layer=LAYERS.DEVICE_REMOVE,
+    handle_remove_layer=LAYERS.HANDLE_REMOVE,
+    via_layers=[LAYERS.VIAS_ETCH, LAYERS.POLY, LAYERS.OXIDE, LAYERS.NITRIDE],
+    merged=not args.no_merge,
+).nets(bond_pads(), "DEVICE")
+writer.text(
+    f"./build/mega_pc_{args.version}_BUILD_NETS.txt",
+    "".join(f"{pad}: {net}\n" for pad, net in pad_nets.items()),
+)
+if args.netlist is not None:
+    errors = nets.check(pad_nets, nets.load(args.netlist))
+    if errors:
+        raise RuntimeError("Netlist check failed:\n" + "\n".join(errors))
+
+# DENSITY
+for layer in DENSITY_LAYERS:
+    box, data = density(c.kdb_cell, gf.get_layer(layer), DENSITY_TILE_SIZE)
+    path = f"./build/mega_pc_{args.version}_BUILD_DENSITY_{LAYERS(layer)}"
+    for suffix, content in render(
+        os.path.basename(path),
+        box,
+        data,
+        DENSITY_TILE_SIZE,
+        args.density_window,
+    ).items():
+        writer.data(f"{path}{suffix}", content)
+    print(
+        f"DENSITY {LAYERS(layer)}: {data.min():.3f} - {data.max():.3f}, "
+        f"{len(flagged(box, data, DENSITY_TILE_SIZE, args.density_window))} tiles "
+        f"outside of window"
+    )
 
-if not args.no_merge:
-    # generate reticles
-    reticles, placements = gb.asml300.reticle(
+# FRACTURE
+if args.max_vertices:
+    fracture(c, layers=list(LAYERS), max_vertices=args.max_vertices)
+
+writer.write(c, f"./build/mega_pc_{args.version}_BUILD", format=args.build_format)
+
+if not args.no_merge and not args.draft:
+    # generate reticles, laid out by gb or packed by packing.pack
+    image_layers = [
+        LAYERS.VIAS_ETCH,
+        LAYERS.POLY,
+        LAYERS.OXIDE,
+        LAYERS.NITRIDE,
+        LAYERS.DEVICE_REMOVE,
+        LAYERS.CAP_OXIDE,
+        LAYERS.CAP_NITRIDE,
+        LAYERS.CAP_TRENCH_ETCH,
+    ]
+    reticles, placements = assemble(
         component=c,
         image_size=(CHIP_SIZE, CHIP_SIZE),
-        image_layers=[
-            LAYERS.VIAS_ETCH,
-            LAYERS.POLY,
-            LAYERS.OXIDE,
-            LAYERS.NITRIDE,
-            LAYERS.DEVICE_REMOVE,
-            LAYERS.CAP_OXIDE,
-            LAYERS.CAP_NITRIDE,
-            LAYERS.CAP_TRENCH_ETCH,
-        ],
+        image_layers=image_layers,
+        packed=args.pack_reticles,
         id=f"MPC-{args.version}",
         text=date_str,
     )
+    print(f"RETICLES: {len(reticles)} reticles for {len(image_layers)} images")
 
     for i, reticle in enumerate(reticles):
         for key, value in placements.items():
@@ -213,21 +395,29 @@ if not args.no_merge:
                     justify="center",
                     layer=LAYERS.DUMMY,
                 )
-        reticle.flatten()
-        reticle.write_gds(
-            f"./build/mega_pc_{args.version}_BUILD_ASML_{i}.gds", with_metadata=False
+        writer.write(
+            reticle,
+            f"./build/mega_pc_{args.version}_BUILD_ASML_{i}",
+            format=args.reticle_format,
+            process=True,
         )
 
         if args.mirror:
             reticle.mirror_x(0)
-            reticle.write_gds(
-                f"./build/mega_pc_{args.version}_BUILD_ASML_{i}_MIRROR.gds",
-                with_metadata=False,
+            writer.write(
+                reticle,
+                f"./build/mega_pc_{args.version}_BUILD_ASML_{i}_MIRROR",
+                format=args.reticle_format,
+                process=True,
             )
 
-    with open(f"./build/mega_pc_{args.version}_BUILD_ASML_PLACEMENTS.txt", "w") as f:
-        for key, value in placements.items():
-            f.write(f"{LAYERS(key)}: {value[0]}, {value[1]:.2f}, {value[2]:.2f}\n")
+    writer.text(
+        f"./build/mega_pc_{args.version}_BUILD_ASML_PLACEMENTS.txt",
+        "".join(
+            f"{LAYERS(key)}: {value[0]}, {value[1]:.2f}, {value[2]:.2f}\n"
+            for key, value in placements.items()
+        ),
+    )
 
     # generate wafer masks for backside
     for layer in [LAYERS.HANDLE_REMOVE, LAYERS.CAP_BACKSIDE]:
@@ -242,33 +432,92 @@ if not args.no_merge:
             id=f"MPC-{args.version}-{LAYERS(layer)}",
             text=date_str,
         )
-        wafer.write_gds(
-            f"./build/mega_pc_{args.version}_BUILD_WAFER_{LAYERS(layer)}.gds",
-            with_metadata=False,
+        writer.write(
+            wafer,
+            f"./build/mega_pc_{args.version}_BUILD_WAFER_{LAYERS(layer)}",
+            format=args.wafer_format,
         )
 
         if args.mirror:
             wafer.mirror_x(0)
-            wafer.write_gds(
-                f"./build/mega_pc_{args.version}_BUILD_WAFER_{LAYERS(layer)}_MIRROR.gds",
-                with_metadata=False,
+            writer.write(
+                wafer,
+                f"./build/mega_pc_{args.version}_BUILD_WAFER_{LAYERS(layer)}_MIRROR",
+                format=args.wafer_format,
             )
 
-        with open(
+        writer.text(
             f"./build/mega_pc_{args.version}_BUILD_WAFER_{LAYERS(layer)}_PLACEMENTS.txt",
-            "w",
-        ) as f:
-            f.write(f"WAFER_DIAMETER: {WAFER_DIAMETER:.2f}\n")
-            f.write(f"X_STEP_SIZE: {CHIP_SIZE:.2f}\n")
-            f.write(f"Y_STEP_SIZE: {CHIP_SIZE:.2f}\n")
-            f.write(f"CHIP_COUNT: {len(placements)}\n")
-            f.write(f"\n")
-            for mark in WAFER_ALIGNMENT_MARKS:
-                f.write(f"MARK: {mark[0]:.2f}, {mark[1]:.2f}\n")
-            f.write(f"\n")
-            for placement in placements:
-                f.write(f"CHIP: {placement[0]:.2f}, {placement[1]:.2f}\n")
+            placements_text((CHIP_SIZE, CHIP_SIZE), placements),
+        )
+
+    # mixed-design site plans for the backside, one PLACEMENTS file per design.
+    # The plans have no alignment marks or wafer id, so they are not wafer masks
+    # and are not written as BUILD_WAFER artifacts
+    if args.sites is not None:
+        paths, site_map = load_sites(args.sites)
+        designs = {"MEGA_PC": c}
+        designs.update({key: load(path, name=key) for key, path in paths.items()})
+
+        for layer in [LAYERS.HANDLE_REMOVE, LAYERS.CAP_BACKSIDE]:
+            base = f"./build/mega_pc_{args.version}_SITES_{LAYERS(layer)}"
+            wafer, placements = compose(
+                designs=designs,
+                site_map=site_map,
+                step=(CHIP_SIZE, CHIP_SIZE),
+                layers=[layer],
+                name=f"wafer_sites_{LAYERS(layer)}",
+            )
+            writer.write(wafer, base, format=args.wafer_format)
 
+            for design, centers in placements.items():
+                writer.text(
+                    f"{base}_{design}_PLACEMENTS.txt",
+                    placements_text((CHIP_SIZE, CHIP_SIZE), centers),
+                )
+            print(
+                f"SITES {LAYERS(layer)}: {len(site_map)} sites, "
+                f"{len(placements)} designs"
+            )
+
+# wait for all outputs to be written and flushed to disk
+checksums = writer.wait()
+
+# the label-free cache is only written when it was rebuilt, so it is not an
+# artifact of the build
+artifacts = [path for path in checksums if not os.path.dirname(path).endswith("cache")]
+with open(f"./build/mega_pc_{args.version}_SHA256SUMS.txt", "w") as f:
+    for path in artifacts:
+        checksum = checksums[path]
+        path = os.path.relpath(path, "./build")
+        f.write(f"{checksum}  {path}\n")
+
+previews = []
+if args.preview:
+    for path in artifacts:
+        name = os.path.basename(path)
+        if (
+            "_BUILD" in name
+            and "_MIRROR" not in name
+            and name.endswith(tuple(FORMATS.values()))
+        ):
+            previews += preview(path, resolution=args.preview)
+
+# content hashes of each artifact and layer, compared against the manifest of
+# the previous release with artifacts.py. The source and build layouts hold
+# the version label in LABEL_TILE, so they are also hashed without it
+labeled = [
+    f"./build/mega_pc_{args.version}_SOURCE",
+    f"./build/mega_pc_{args.version}_BUILD",
+]
+write_manifest(
+    f"./build/mega_pc_{args.version}_MANIFEST.json",
+    manifest(
+        artifacts + [f"./build/mega_pc_{args.version}_SHA256SUMS.txt"] + previews,
+        args.version,
+        labels={path: [LABEL_TILE] for path in artifacts if stem(path) in labeled},
+    ),
+)
 
 if args.show:
     c.show()
@@ -0,0 +1,292 @@
+import argparse
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import runpy
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BUILD = os.path.join(DIRECTORY, "build.py")
+SOCKET = os.path.join(DIRECTORY, "build", "daemon.sock")
+
+
+def _warm() -> None:
+    # imports, the active PDK and the label-free device cells are inherited by
+    # every forked build, only the label and the boolean pipeline are rebuilt
+    import gfelib
+    import gfebuild
+
+    from device import device_unlabeled
+
+    device_unlabeled()
+
+
+def _argv(request: dict) -> list[str]:
+    # build.py command line of a request, options are long flags without the
+    # leading dashes, True for a bare flag and lists for multiple values
+    argv = [BUILD, "--version", str(request["version"])]
+    if request.get("hash"):
+        argv += ["--hash", str(request["hash"])]
+
+    for key, value in request.get("options", {}).items():
+        flag = f"--{key.replace('_', '-')}"
+        if value is True:
+            argv.append(flag)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            argv += [flag, *(str(v) for v in value)]
+        else:
+            argv += [flag, str(value)]
+
+    return argv
+
+
+def _run(argv: list[str], log: str) -> None:
+    # forked child, output goes to the request log
+    fd = os.open(log, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+
+    # the warm cells are at production detail, drafts import device.py again
+    if "--draft" in argv:
+        import gdsfactory as gf
+
+        gf.clear_cache()
+        sys.modules.pop("device", None)
+
+    sys.argv = argv
+    runpy.run_path(argv[0], run_name="__main__")
+
+
+def _launch(
+    requests: multiprocessing.connection.Connection,
+    replies: multiprocessing.connection.Connection,
+    daemon: list[multiprocessing.connection.Connection],
+) -> None:
+    # forked before the server starts any thread, every build is forked from
+    # this single thread. Receives (key, argv, log), replies (key, exit code)
+    # once the build exits, stops when the daemon closes the requests
+    for conn in daemon:
+        conn.close()
+
+    context = multiprocessing.get_context("fork")
+    running = {}
+    while True:
+        for ready in multiprocessing.connection.wait([requests, *running]):
+            if ready is requests:
+                try:
+                    key, argv, log = requests.recv()
+                except EOFError:
+                    return
+                process = context.Process(target=_run, args=(argv, log))
+                process.start()
+                running[process.sentinel] = (key, process)
+            else:
+                key, process = running.pop(ready)
+                process.join()
+                replies.send((key, process.exitcode))
+
+
+class _Launcher:
+    # client of the _launch process, shared by the request threads
+    def __init__(self) -> None:
+        requests, self._requests = multiprocessing.Pipe(duplex=False)
+        self._replies, replies = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.get_context("fork").Process(
+            target=_launch,
+            args=(requests, replies, [self._requests, self._replies]),
+        )
+        self._process.start()
+        requests.close()
+        replies.close()
+
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._count = 0
+        threading.Thread(target=self._receive, daemon=True).start()
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                key, exitcode = self._replies.recv()
+            except EOFError:
+                return
+            with self._lock:
+                done = self._waiting.pop(key)
+            done.put(exitcode)
+
+    def run(self, argv: list[str], log: str) -> int:
+        # blocks until the build exits, returns its exit code
+        done = queue.Queue(maxsize=1)
+        with self._lock:
+            self._count += 1
+            self._waiting[self._count] = done
+            self._requests.send((self._count, argv, log))
+        return done.get()
+
+    def close(self) -> None:
+        # the launcher stops once the running builds are done
+        self._requests.close()
+        self._process.join()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # one JSON request per line, answered with one JSON response per line
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                response = self.server.build(json.loads(line))
+            except Exception as e:
+                response = {"ok": False, "error": repr(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # each request runs build.py in a process forked from the warm daemon, so
+    # requests share nothing but the files under ./build. The forks come from
+    # a launcher process started before any thread, never from the request
+    # threads
+    daemon_threads = True
+
+    def __init__(self, path: str = SOCKET, workers: int = 2) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._launcher = _Launcher()
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._running = set()
+
+    def build(self, request: dict) -> dict:
+        # outputs are named by version, concurrent builds of one version would
+        # overwrite each other
+        version = str(request["version"])
+        with self._lock:
+            if version in self._running:
+                return {"ok": False, "error": f"Version {version} is already building"}
+            self._running.add(version)
+
+        try:
+            with self._slots:
+                start = time.time()
+                log = f"./build/mega_pc_{version}_BUILD_LOG.txt"
+                exitcode = self._launcher.run(_argv(request), log)
+        finally:
+            with self._lock:
+                self._running.discard(version)
+
+        # the manifest lists what the build wrote, SHA256SUMS and previews
+        # included, it is only current when the build succeeded
+        artifacts = []
+        if exitcode == 0:
+            manifest = f"./build/mega_pc_{version}_MANIFEST.json"
+            with open(manifest) as f:
+                files = [value["file"] for value in json.load(f)["artifacts"].values()]
+            artifacts = sorted(
+                os.path.abspath(os.path.join("./build", file)) for file in files
+            )
+            artifacts.append(os.path.abspath(manifest))
+        return {
+            "ok": exitcode == 0,
+            "exitcode": exitcode,
+            "seconds": time.time() - start,
+            "log": os.path.abspath(log),
+            "artifacts": artifacts,
+        }
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._launcher.close()
+
+
+def submit(request: dict, path: str = SOCKET) -> dict:
+    # blocks until the build finishes
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall((json.dumps(request) + "\n").encode())
+        with s.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm build daemon for MEGA-PC")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="Start the daemon")
+    serve.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        help="Builds that run at the same time",
+        default=2,
+    )
+
+    request = subparsers.add_parser("submit", help="Submit a build and wait for it")
+    request.add_argument(
+        "--version",
+        action="store",
+        type=str,
+        help="Add version number text",
+        required=True,
+    )
+    request.add_argument(
+        "--hash",
+        action="store",
+        type=str,
+        help="Add hash text",
+        default="",
+    )
+    request.add_argument(
+        "--option",
+        action="append",
+        type=str,
+        help="build.py option as KEY or KEY=VALUE (JSON for lists), can be repeated",
+        default=[],
+    )
+
+    for subparser in [serve, request]:
+        subparser.add_argument(
+            "--socket",
+            action="store",
+            type=str,
+            help="Unix socket path",
+            default=SOCKET,
+        )
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        # build.py writes relative to the repository
+        os.chdir(DIRECTORY)
+        _warm()
+
+        with Daemon(args.socket, workers=args.workers) as daemon:
+            print(f"Serving on {args.socket}")
+            daemon.serve_forever()
+    else:
+        options = {}
+        for option in args.option:
+            key, _, value = option.partition("=")
+            try:
+                options[key] = json.loads(value) if value else True
+            except json.JSONDecodeError:
+                options[key] = value
+
+        response = submit(
+            {"version": args.version, "hash": args.hash, "options": options},
+            path=args.socket,
+        )
+        print(json.dumps(response, indent=2))
+        sys.exit(0 if response["ok"] else 1)
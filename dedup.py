@@ -0,0 +1,70 @@
+import klayout.db as kdb
+
+import hashlib
+
+
+def fingerprint(cell: kdb.Cell, cache: dict[int, str] | None = None) -> str:
+    # sha256 of the geometry of a cell and its children, independent of cell
+    # names and of how the polygons are split, merged polygons per layer and
+    # child fingerprints with their placements
+    cache = {} if cache is None else cache
+    if cell.cell_index() in cache:
+        return cache[cell.cell_index()]
+
+    layout = cell.layout()
+    h = hashlib.sha256()
+    for layer in sorted(layout.layer_indexes(), key=lambda i: str(layout.get_info(i))):
+        shapes = cell.shapes(layer)
+        if shapes.is_empty():
+            continue
+
+        h.update(f"L{layout.get_info(layer)}\n".encode())
+        polygons = sorted(str(p) for p in kdb.Region(shapes).merged().each())
+        texts = sorted(str(s.text) for s in shapes.each(kdb.Shapes.STexts))
+        for item in polygons + texts:
+            h.update(f"{item}\n".encode())
+
+    instances = []
+    for inst in cell.each_inst():
+        array = inst.cell_inst
+        instances.append(
+            f"I{fingerprint(layout.cell(inst.cell_index), cache)} "
+            f"{array.cplx_trans} {array.a} {array.b} {array.na} {array.nb}"
+        )
+    for item in sorted(instances):
+        h.update(f"{item}\n".encode())
+
+    cache[cell.cell_index()] = h.hexdigest()
+    return cache[cell.cell_index()]
+
+
+def fingerprints(layout: kdb.Layout) -> dict[str, str]:
+    # fingerprint of each cell by name
+    cache = {}
+    return {cell.name: fingerprint(cell, cache) for cell in layout.each_cell()}
+
+
+def deduplicate(layout: kdb.Layout) -> int:
+    # keeps one cell of each fingerprint, rewires the instances of the others
+    # to it and deletes them, returns the number of deleted cells
+    cache = {}
+    canonical = {}
+    replace = {}
+    for index in layout.each_cell_bottom_up():
+        key = fingerprint(layout.cell(index), cache)
+        if key in canonical:
+            replace[index] = canonical[key]
+        else:
+            canonical[key] = index
+
+    for index in layout.each_cell_bottom_up():
+        if index in replace:
+            continue
+        for inst in list(layout.cell(index).each_inst()):
+            if inst.cell_index in replace:
+                inst.cell_index = replace[inst.cell_index]
+
+    for index in replace:
+        layout.delete_cell(index)
+
+    return len(replace)
@@ -0,0 +1,189 @@
+import klayout.db as kdb
+import numpy as np
+
+import argparse
+import io
+import os
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+import output
+from pdk import LAYERS
+
+
+class _Receiver(kdb.TileOutputReceiver):
+    def __init__(self, data: np.ndarray) -> None:
+        self.data = data
+
+    def put(self, ix, iy, tile, obj, dbu, clip) -> None:
+        self.data[iy, ix] = obj
+
+
+def density(
+    cell: kdb.Cell,
+    layer: int,
+    tile_size: float,
+    threads: int | None = None,
+) -> tuple[kdb.DBox, np.ndarray]:
+    # covered area fraction of each tile, row 0 is the bottom row of tiles
+    layout = cell.layout()
+    box = cell.dbbox()
+    nx = max(int(np.ceil(box.width() / tile_size)), 1)
+    ny = max(int(np.ceil(box.height() / tile_size)), 1)
+    data = np.zeros((ny, nx))
+
+    tp = kdb.TilingProcessor()
+    tp.dbu = layout.dbu
+    tp.tile_size(tile_size, tile_size)
+    tp.tile_origin(box.left, box.bottom)
+    tp.tiles(nx, ny)
+    tp.threads = threads or os.cpu_count()
+    tp.input("region", layout, cell.cell_index(), layer)
+    tp.output("density", _Receiver(data))
+    tp.queue("_output(density, to_f(region.area(_tile.bbox)) / to_f(_tile.bbox.area))")
+    tp.execute("Density map")
+
+    return (
+        kdb.DBox(
+            box.left, box.bottom, box.left + nx * tile_size, box.bottom + ny * tile_size
+        ),
+        data,
+    )
+
+
+def flagged(
+    box: kdb.DBox,
+    data: np.ndarray,
+    tile_size: float,
+    window: tuple[float, float],
+) -> list[tuple[float, float, float]]:
+    # (x, y, density) of the tile centers outside of the density window
+    iy, ix = np.nonzero((data < window[0]) | (data > window[1]))
+    return [
+        (
+            box.left + (x + 0.5) * tile_size,
+            box.bottom + (y + 0.5) * tile_size,
+            data[y, x],
+        )
+        for x, y in zip(ix, iy)
+    ]
+
+
+def render(
+    name: str,
+    box: kdb.DBox,
+    data: np.ndarray,
+    tile_size: float,
+    window: tuple[float, float] | None = None,
+) -> dict[str, bytes]:
+    # contents of the .npy, .csv and .png files by suffix
+    files = {}
+
+    buffer = io.BytesIO()
+    np.save(buffer, data)
+    files[".npy"] = buffer.getvalue()
+
+    csv = "x,y,density\n"
+    for y in range(data.shape[0]):
+        for x in range(data.shape[1]):
+            csv += (
+                f"{box.left + (x + 0.5) * tile_size:.2f},"
+                f"{box.bottom + (y + 0.5) * tile_size:.2f},"
+                f"{data[y, x]:.4f}\n"
+            )
+    files[".csv"] = csv.encode()
+
+    fig, ax = plt.subplots()
+    image = ax.imshow(
+        data,
+        origin="lower",
+        extent=(box.left, box.right, box.bottom, box.top),
+        cmap="viridis",
+        vmin=0,
+        vmax=1,
+    )
+    if window is not None:
+        for x, y, _ in flagged(box, data, tile_size, window):
+            ax.add_patch(
+                plt.Rectangle(
+                    (x - 0.5 * tile_size, y - 0.5 * tile_size),
+                    tile_size,
+                    tile_size,
+                    fill=False,
+                    edgecolor="red",
+                )
+            )
+    fig.colorbar(image, ax=ax, label="density")
+    ax.set_title(name)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=200)
+    plt.close(fig)
+    files[".png"] = buffer.getvalue()
+
+    return files
+
+
+def export(
+    path: str,
+    box: kdb.DBox,
+    data: np.ndarray,
+    tile_size: float,
+    window: tuple[float, float] | None = None,
+) -> None:
+    for suffix, content in render(
+        os.path.basename(path), box, data, tile_size, window
+    ).items():
+        with open(f"{path}{suffix}", "wb") as f:
+            f.write(content)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pattern density maps for MEGA-PC")
+    parser.add_argument(
+        "file",
+        help="GDS/OASIS file to analyze",
+    )
+    parser.add_argument(
+        "--layer",
+        action="append",
+        type=str,
+        help="Layer name, can be repeated",
+        required=True,
+    )
+    parser.add_argument(
+        "--tile-size",
+        action="store",
+        type=float,
+        help="Tile size in um",
+        default=200,
+    )
+    parser.add_argument(
+        "--window",
+        action="store",
+        type=float,
+        nargs=2,
+        help="Flag tiles with density outside of [MIN, MAX]",
+        default=None,
+    )
+
+    args = parser.parse_args()
+
+    layout = kdb.Layout()
+    layout.read(args.file)
+    stem = output.stem(args.file)
+
+    for name in args.layer:
+        layer = LAYERS[name]
+        layer_index = layout.find_layer(layer.layer, layer.datatype)
+        if layer_index is None:
+            raise ValueError(f"Layer {name} not found in {args.file}")
+
+        box, data = density(layout.top_cell(), layer_index, args.tile_size)
+        export(f"{stem}_DENSITY_{name}", box, data, args.tile_size, args.window)
+
+        if args.window is not None:
+            for x, y, value in flagged(box, data, args.tile_size, args.window):
+                print(f"{name}: {x:.2f}, {y:.2f}, {value:.4f}")
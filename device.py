@@ -1,11 +1,14 @@
 import gdsfactory as gf
 import gfelib as gl
-import klayout
+import klayout.db as kdb
 
 import numpy as np
 import functools
+import os
 
 from pdk import LAYERS, PDK
+from geometry import insert, region
+import assets
 
 PDK.activate()
 
@@ -15,14 +18,23 @@ static_cell = functools.partial(gf.cell, check_instances=False)
 CHIP_SIZE = 8000
 CHIP_BORDER_WIDTH = 200
 
-ANGLE_RESOLUTION = 0.1
+# draft level of detail for floorplanning and connectivity review, set by
+# build.py --draft before the first import: coarse arcs, release hole fields as
+# DRAFT_RELEASE outline markers, gear teeth as their envelope and no logos
+DRAFT = os.environ.get("MEGA_PC_DRAFT") == "1"
+
+ANGLE_RESOLUTION = 1 if DRAFT else 0.1
 CAVITY_WIDTH = 40
 
-RELEASE_SPEC = gl.datatypes.ReleaseSpec(
-    hole_radius=3,
-    distance=6,
-    angle_resolution=18,
-    layer=LAYERS.DEVICE_REMOVE,
+RELEASE_SPEC = (
+    None
+    if DRAFT
+    else gl.datatypes.ReleaseSpec(
+        hole_radius=3,
+        distance=6,
+        angle_resolution=18,
+        layer=LAYERS.DEVICE_REMOVE,
+    )
 )
 
 CENTER_CARRIAGE_RADIUS = 375
@@ -53,6 +65,10 @@ RDRIVE_TEETH_CLEARANCE = 2.5
 RDRIVE_TEETH_PHASE = [-120, 0, 120]
 RDRIVE_TEETH_COUNT = 90
 RDRIVE_ROTOR_SPAN = 160
+# half the tooth pitch at the stator tips, closes the tooth gaps in drafts
+RDRIVE_TEETH_ENVELOPE = (
+    0.5 * np.radians(RDRIVE_TEETH_PITCH) * (RDRIVE_MID_RADIUS + RDRIVE_TEETH_HEIGHT)
+)
 
 ZDRIVE_CLEARANCE = 8
 ZDRIVE_INNER_RADIUS = 2250
@@ -101,6 +117,15 @@ CAP_CHIP_SIZE = 5000
 CAP_TRENCH_INNER_RADIUS = 450
 CAP_TRENCH_OUTER_RADIUS = 2600
 
+SYMBOL_LIBRARY = "lib/gdslib_fun_symbols/main.gds"
+
+LOGO_POS = 2 * WIRE_BOND_SIZE + WIRE_BOND_OFFSET + CAVITY_WIDTH
+LOGO_SIZE = 0.5 * CHIP_SIZE - CHIP_BORDER_WIDTH - LOGO_POS - CAVITY_WIDTH
+LABEL_TILE = (
+    (-LOGO_POS - LOGO_SIZE, LOGO_POS),
+    (-LOGO_POS, LOGO_POS + LOGO_SIZE),
+)
+
 
 via = gl.basic.via(
     radius_first=20,
@@ -115,28 +140,66 @@ via = gl.basic.via(
 )
 
 
+@static_cell
+def _release_field(component: gf.Component) -> gf.Component:
+    c = gf.Component()
+
+    _ = c << component
+    insert(c, LAYERS.DRAFT_RELEASE, region(component, LAYERS.DEVICE).merged())
+
+    return c
+
+
+def release_field(component: gf.Component) -> gf.Component:
+    # draft builds mark the DEVICE geometry that would get release holes
+    return _release_field(component) if DRAFT else component
+
+
+@static_cell
+def _teeth_envelope(component: gf.Component, distance: float) -> gf.Component:
+    c = gf.Component()
+
+    # closed per polygon, rotor and stator are closer than the tooth gaps
+    d = c.kcl.to_dbu(distance)
+    for layer in component.layers:
+        shapes = region(component, layer).merged()
+        if gf.get_layer(layer) == gf.get_layer(LAYERS.DEVICE):
+            envelope = kdb.Region()
+            for polygon in shapes.each():
+                envelope += kdb.Region(polygon).sized(d).sized(-d)
+            shapes = envelope.merged()
+        insert(c, layer, shapes)
+
+    return c
+
+
+def teeth_envelope(component: gf.Component, distance: float) -> gf.Component:
+    # draft builds fill the gaps between teeth up to distance from each side
+    return _teeth_envelope(component, distance) if DRAFT else component
+
+
 @static_cell
 def chip_border() -> gf.Component:
     c = gf.Component()
 
-    _ = c << gl.device.chip_border(
-        size=(CHIP_SIZE, CHIP_SIZE),
-        width=CHIP_BORDER_WIDTH,
-        geometry_layer=LAYERS.DEVICE,
-        handle_layer=LAYERS.HANDLE_P7,
-        centered=True,
-        release_spec=RELEASE_SPEC,
+    _ = c << release_field(
+        gl.device.chip_border(
+            size=(CHIP_SIZE, CHIP_SIZE),
+            width=CHIP_BORDER_WIDTH,
+            geometry_layer=LAYERS.DEVICE,
+            handle_layer=LAYERS.HANDLE_P7,
+            centered=True,
+            release_spec=RELEASE_SPEC,
+        )
     )
 
-    pos = 2 * WIRE_BOND_SIZE + WIRE_BOND_OFFSET + CAVITY_WIDTH
-    size = 0.5 * CHIP_SIZE - CHIP_BORDER_WIDTH - pos - CAVITY_WIDTH
     for r in [0, 90, 180, 270]:
         ref = c << gf.components.rectangle(
-            size=(size, size),
+            size=(LOGO_SIZE, LOGO_SIZE),
             layer=LAYERS.DEVICE,
             centered=False,
         )
-        ref.move((pos, pos))
+        ref.move((LOGO_POS, LOGO_POS))
         ref.rotate(angle=r, center=(0, 0))
 
     return c
@@ -210,17 +273,19 @@ def center_carriage() -> gf.Component:
 def r_flexure_half() -> gf.Component:
     c = gf.Component()
 
-    _ = c << gl.flexure.butterfly(
-        radius0=RFLEX_INNER_RADIUS0,
-        radius1=RFLEX_INNER_RADIUS1,
-        radius2=RFLEX_ANCHOR_RADIUS0,
-        width_beam=RFLEX_BEAM_WIDTH,
-        angles=RFLEX_BEAM_ANGLES,
-        release_inner=True,
-        geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
-        beam_spec=RFLEX_BEAM_SPEC,
-        release_spec=RELEASE_SPEC,
+    _ = c << release_field(
+        gl.flexure.butterfly(
+            radius0=RFLEX_INNER_RADIUS0,
+            radius1=RFLEX_INNER_RADIUS1,
+            radius2=RFLEX_ANCHOR_RADIUS0,
+            width_beam=RFLEX_BEAM_WIDTH,
+            angles=RFLEX_BEAM_ANGLES,
+            release_inner=True,
+            geometry_layer=LAYERS.DEVICE,
+            angle_resolution=ANGLE_RESOLUTION,
+            beam_spec=RFLEX_BEAM_SPEC,
+            release_spec=RELEASE_SPEC,
+        )
     )
 
     beam_angle = RFLEX_BEAM_ANGLES[0]
@@ -253,59 +318,68 @@ def r_flexure_half() -> gf.Component:
 def r_drive_half() -> gf.Component:
     c = gf.Component()
 
-    _ = c << gl.actuator.rotator_gear(
-        radius_inner=RDRIVE_INNER_RADIUS,
-        radius_gap=RDRIVE_MID_RADIUS,
-        radius_outer=RDRIVE_OUTER_RADIUS,
-        teeth_pitch=RDRIVE_TEETH_PITCH,
-        teeth_width=RDRIVE_TEETH_WIDTH,
-        teeth_height=RDRIVE_TEETH_HEIGHT,
-        teeth_clearance=RDRIVE_TEETH_CLEARANCE,
-        teeth_phase=RDRIVE_TEETH_PHASE,
-        teeth_count=RDRIVE_TEETH_COUNT,
-        inner_rotor=True,
-        rotor_span=RDRIVE_ROTOR_SPAN,
-        geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
-        release_spec=RELEASE_SPEC,
+    _ = c << release_field(
+        teeth_envelope(
+            gl.actuator.rotator_gear(
+                radius_inner=RDRIVE_INNER_RADIUS,
+                radius_gap=RDRIVE_MID_RADIUS,
+                radius_outer=RDRIVE_OUTER_RADIUS,
+                teeth_pitch=RDRIVE_TEETH_PITCH,
+                teeth_width=RDRIVE_TEETH_WIDTH,
+                teeth_height=RDRIVE_TEETH_HEIGHT,
+                teeth_clearance=RDRIVE_TEETH_CLEARANCE,
+                teeth_phase=RDRIVE_TEETH_PHASE,
+                teeth_count=RDRIVE_TEETH_COUNT,
+                inner_rotor=True,
+                rotor_span=RDRIVE_ROTOR_SPAN,
+                geometry_layer=LAYERS.DEVICE,
+                angle_resolution=ANGLE_RESOLUTION,
+                release_spec=RELEASE_SPEC,
+            ),
+            RDRIVE_TEETH_ENVELOPE,
+        )
     )
 
     beam_angle = 90 - RFLEX_BEAM_ANGLES[1]
     connector0_angle = beam_angle + 0.5 * RFLEX_BEAM_WIDTH / RFLEX_ANCHOR_RADIUS1 / (
         np.pi / 180
     )
-    _ = c << gl.basic.ring(
-        radius_inner=RFLEX_ANCHOR_RADIUS0,
-        radius_outer=RDRIVE_INNER_RADIUS
-        + gl.utils.sagitta_offset_safe(
-            radius=RDRIVE_INNER_RADIUS,
-            chord=0,
+    _ = c << release_field(
+        gl.basic.ring(
+            radius_inner=RFLEX_ANCHOR_RADIUS0,
+            radius_outer=RDRIVE_INNER_RADIUS
+            + gl.utils.sagitta_offset_safe(
+                radius=RDRIVE_INNER_RADIUS,
+                chord=0,
+                angle_resolution=ANGLE_RESOLUTION,
+            ),
+            angles=(-connector0_angle, connector0_angle),
+            geometry_layer=LAYERS.DEVICE,
             angle_resolution=ANGLE_RESOLUTION,
-        ),
-        angles=(-connector0_angle, connector0_angle),
-        geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
-        release_spec=RELEASE_SPEC,
+            release_spec=RELEASE_SPEC,
+        )
     )
 
     connector1_angle = 0.5 * beam_angle
-    _ = c << gl.basic.ring(
-        radius_inner=CENTER_CARRIAGE_RADIUS
-        - gl.utils.sagitta_offset_safe(
-            radius=CENTER_CARRIAGE_RADIUS,
-            chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
-        ),
-        radius_outer=RFLEX_ANCHOR_RADIUS0
-        + gl.utils.sagitta_offset_safe(
-            radius=RFLEX_ANCHOR_RADIUS0,
-            chord=0,
+    _ = c << release_field(
+        gl.basic.ring(
+            radius_inner=CENTER_CARRIAGE_RADIUS
+            - gl.utils.sagitta_offset_safe(
+                radius=CENTER_CARRIAGE_RADIUS,
+                chord=0,
+                angle_resolution=ANGLE_RESOLUTION,
+            ),
+            radius_outer=RFLEX_ANCHOR_RADIUS0
+            + gl.utils.sagitta_offset_safe(
+                radius=RFLEX_ANCHOR_RADIUS0,
+                chord=0,
+                angle_resolution=ANGLE_RESOLUTION,
+            ),
+            angles=(-connector1_angle, connector1_angle),
+            geometry_layer=LAYERS.DEVICE,
             angle_resolution=ANGLE_RESOLUTION,
-        ),
-        angles=(-connector1_angle, connector1_angle),
-        geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
-        release_spec=RELEASE_SPEC,
+            release_spec=RELEASE_SPEC,
+        )
     )
 
     _ = c << gl.basic.ring(
@@ -411,15 +485,17 @@ def z_cant_half() -> gf.Component:
         spec=Z_CANT_BEAM_SPEC,
     )
 
-    _ = c << gl.flexure.z_cantilever_half(
-        length=total_length,
-        width=ZCANT_WIDTH,
-        beams=[cant_beam0, cant_beam1, cant_beam2, cant_beam3],
-        clearance=ZDRIVE_CLEARANCE,
-        middle_split=True,
-        geometry_layer=LAYERS.DEVICE,
-        handle_layer=LAYERS.HANDLE_P0,
-        release_spec=RELEASE_SPEC,
+    _ = c << release_field(
+        gl.flexure.z_cantilever_half(
+            length=total_length,
+            width=ZCANT_WIDTH,
+            beams=[cant_beam0, cant_beam1, cant_beam2, cant_beam3],
+            clearance=ZDRIVE_CLEARANCE,
+            middle_split=True,
+            geometry_layer=LAYERS.DEVICE,
+            handle_layer=LAYERS.HANDLE_P0,
+            release_spec=RELEASE_SPEC,
+        )
     )
 
     anchor0_ref = c << gf.components.rectangle(
@@ -443,11 +519,13 @@ def z_cant_half() -> gf.Component:
     anchor1_ref.move((ZCANT_LENGTH1 - 0.5 * ZCANT_BEAM1_WIDTH, anchor1_y))
 
     anchor2_y = 0.5 * ZCANT_WIDTH - ZCANT_BEAM2_INSET + ZCANT_BEAM2_LENGTH
-    anchor2_ref = c << gl.basic.rectangle(
-        size=(0.5 * ZDRIVE_ANCHOR_SIZE, ZDRIVE_ANCHOR_SIZE),
-        geometry_layer=LAYERS.DEVICE,
-        centered=False,
-        release_spec=RELEASE_SPEC,
+    anchor2_ref = c << release_field(
+        gl.basic.rectangle(
+            size=(0.5 * ZDRIVE_ANCHOR_SIZE, ZDRIVE_ANCHOR_SIZE),
+            geometry_layer=LAYERS.DEVICE,
+            centered=False,
+            release_spec=RELEASE_SPEC,
+        )
     )
     anchor2_ref.move((total_length - ZACTUATOR_BEAM_WIDTH, anchor2_y))
 
@@ -480,11 +558,13 @@ def z_cant_half() -> gf.Component:
             anchor2_y + ZDRIVE_ANCHOR_SIZE, 0.5 * ZACTUATOR_WIDTH, ZACTUATOR_LENGTH_STEP
         ),
     ):
-        rect_ref = c << gl.basic.rectangle(
-            size=(x_size, y),
-            geometry_layer=LAYERS.DEVICE,
-            centered=False,
-            release_spec=RELEASE_SPEC,
+        rect_ref = c << release_field(
+            gl.basic.rectangle(
+                size=(x_size, y),
+                geometry_layer=LAYERS.DEVICE,
+                centered=False,
+                release_spec=RELEASE_SPEC,
+            )
         )
         rect_ref.movex(x)
 
@@ -506,14 +586,16 @@ def z_cant_half() -> gf.Component:
     )
     beam3_ref.move((zactuator_beam_x, ZDRIVE_ANCHOR_SIZE))
 
-    rect_ref = c << gl.basic.rectangle(
-        size=(
-            ZDRIVE_ANCHOR_SIZE + ZDRIVE_CLEARANCE,
-            0.5 * ZACTUATOR_WIDTH - ZDRIVE_ANCHOR_SIZE - ZACTUATOR_BEAM_LENGTH,
-        ),
-        geometry_layer=LAYERS.DEVICE,
-        centered=False,
-        release_spec=RELEASE_SPEC,
+    rect_ref = c << release_field(
+        gl.basic.rectangle(
+            size=(
+                ZDRIVE_ANCHOR_SIZE + ZDRIVE_CLEARANCE,
+                0.5 * ZACTUATOR_WIDTH - ZDRIVE_ANCHOR_SIZE - ZACTUATOR_BEAM_LENGTH,
+            ),
+            geometry_layer=LAYERS.DEVICE,
+            centered=False,
+            release_spec=RELEASE_SPEC,
+        )
     )
     rect_ref.move((x_end, ZDRIVE_ANCHOR_SIZE + ZACTUATOR_BEAM_LENGTH))
 
@@ -554,6 +636,16 @@ def z_cant_half() -> gf.Component:
         )
     )
 
+    # wire bond pads are ports up to device_unlabeled, see bond_pads
+    for name, ref in [("CANT", wire_bond0_ref), ("ACT", wire_bond1_ref)]:
+        c.add_port(
+            name=name,
+            center=ref.dcenter,
+            width=WIRE_BOND_SIZE,
+            orientation=90,
+            layer=LAYERS.DEVICE,
+        )
+
     return c
 
 
@@ -575,6 +667,7 @@ def z_drive_half() -> gf.Component:
 
     z_cant_half_ref = c << z_cant_half()
     z_cant_half_ref.movex(ZDRIVE_INNER_RADIUS)
+    c.add_ports(z_cant_half_ref.ports)
 
     return c
 
@@ -583,9 +676,11 @@ def z_drive_half() -> gf.Component:
 def z_drive() -> gf.Component:
     c = gf.Component()
 
-    _ = c << z_drive_half()
-    ref = c << z_drive_half()
-    ref.mirror_y(0)
+    upper_ref = c << z_drive_half()
+    lower_ref = c << z_drive_half()
+    lower_ref.mirror_y(0)
+    c.add_ports(upper_ref.ports, prefix="UPPER_")
+    c.add_ports(lower_ref.ports, prefix="LOWER_")
 
     rect_ref = c << gl.basic.rectangle(
         size=(ZCANT_LENGTH1 + ZCANT_LENGTH2, ZCANT_WIDTH),
@@ -701,13 +796,15 @@ def z_release_lock() -> gf.Component:
         angle_resolution=ANGLE_RESOLUTION,
         release_spec=None,
     )
-    _ = c << gl.basic.ring(
-        radius_inner=middle_radius,
-        radius_outer=CHIP_BOND_RADIUS - CAVITY_WIDTH,
-        angles=Z_RELEASE_LOCK_SPAN,
-        geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
-        release_spec=RELEASE_SPEC,
+    _ = c << release_field(
+        gl.basic.ring(
+            radius_inner=middle_radius,
+            radius_outer=CHIP_BOND_RADIUS - CAVITY_WIDTH,
+            angles=Z_RELEASE_LOCK_SPAN,
+            geometry_layer=LAYERS.DEVICE,
+            angle_resolution=ANGLE_RESOLUTION,
+            release_spec=RELEASE_SPEC,
+        )
     )
 
     return c
@@ -809,7 +906,25 @@ def cap_border_quarter() -> gf.Component:
 
 
 @static_cell
-def device(text: str) -> gf.Component:
+def label(text: str) -> gf.Component:
+    c = gf.Component()
+
+    _ = c << gf.components.text(
+        text=text,
+        size=0.1 * LOGO_SIZE,
+        position=(
+            -LOGO_POS - 0.5 * LOGO_SIZE,
+            LOGO_POS + 0.5 * LOGO_SIZE + (text.count("\n") - 0.5) * 0.1 * LOGO_SIZE,
+        ),
+        justify="center",
+        layer=LAYERS.DEVICE_REMOVE,
+    )
+
+    return c
+
+
+@static_cell
+def device_unlabeled() -> gf.Component:
     c = gf.Component()
 
     chip_border_ref = c << chip_border()
@@ -830,6 +945,7 @@ def device(text: str) -> gf.Component:
     for r in [0, 90, 180, 270]:
         z_drive_ref = c << z_drive()
         z_drive_ref.rotate(angle=r, center=(0, 0))
+        c.add_ports(z_drive_ref.ports, prefix=f"Z{r}_")
 
         chip_bond_ref = c << chip_bond_pad()
         chip_bond_ref.rotate(angle=r, center=(0, 0))
@@ -843,48 +959,44 @@ def device(text: str) -> gf.Component:
     zr_connector_ref = c << zr_connector()
 
     # texts, logos, and easter eggs
-    pos = 2 * WIRE_BOND_SIZE + WIRE_BOND_OFFSET + CAVITY_WIDTH
-    size = 0.5 * CHIP_SIZE - CHIP_BORDER_WIDTH - pos - CAVITY_WIDTH
-
-    _ = c << gf.components.text(
-        text="MEGA-PC\nDaniel He\nCao Lab\nEECS\nUC Berkeley",
-        size=0.1 * size,
-        position=(-pos - 0.5 * size, -pos - 0.25 * size),
-        justify="center",
-        layer=LAYERS.DEVICE_REMOVE,
-    )
-
-    _ = c << gf.components.text(
-        text=text,
-        size=0.1 * size,
-        position=(
-            -pos - 0.5 * size,
-            pos + 0.5 * size + (text.count("\n") - 0.5) * 0.1 * size,
-        ),
-        justify="center",
-        layer=LAYERS.DEVICE_REMOVE,
-    )
+    if not DRAFT:
+        _ = c << gf.components.text(
+            text="MEGA-PC\nDaniel He\nCao Lab\nEECS\nUC Berkeley",
+            size=0.1 * LOGO_SIZE,
+            position=(-LOGO_POS - 0.5 * LOGO_SIZE, -LOGO_POS - 0.25 * LOGO_SIZE),
+            justify="center",
+            layer=LAYERS.DEVICE_REMOVE,
+        )
 
-    symbol_cal = gf.import_gds(
-        "lib/gdslib_fun_symbols/main.gds", "CAL_LOGO"
-    ).remap_layers({(0, 0): LAYERS.DEVICE_REMOVE})
-    symbol_cal.transform(
-        klayout.dbcore.DCplxTrans(
-            mag=0.09 * size,
+        symbol_cal_ref = assets.place(
+            c,
+            assets.symbol(SYMBOL_LIBRARY, "CAL_LOGO", {(0, 0): LAYERS.DEVICE_REMOVE}),
+            mag=0.09 * LOGO_SIZE,
+            position=(LOGO_POS + 0.5 * LOGO_SIZE, -LOGO_POS - 0.5 * LOGO_SIZE),
         )
-    )
-    symbol_cal_ref = c << symbol_cal
-    symbol_cal_ref.move((pos + 0.5 * size, -pos - 0.5 * size))
 
-    symbol_eye = gf.import_gds(
-        "lib/gdslib_fun_symbols/main.gds", "EYE_OF_THE_UNIVERSE"
-    ).remap_layers({(0, 0): LAYERS.DEVICE_REMOVE})
-    symbol_eye.transform(
-        klayout.dbcore.DCplxTrans(
-            mag=0.09 * size,
+        symbol_eye_ref = assets.place(
+            c,
+            assets.symbol(
+                SYMBOL_LIBRARY, "EYE_OF_THE_UNIVERSE", {(0, 0): LAYERS.DEVICE_REMOVE}
+            ),
+            mag=0.09 * LOGO_SIZE,
+            position=(LOGO_POS + 0.5 * LOGO_SIZE, LOGO_POS + 0.5 * LOGO_SIZE),
         )
-    )
-    symbol_eye_ref = c << symbol_eye
-    symbol_eye_ref.move((pos + 0.5 * size, pos + 0.5 * size))
 
     return c
+
+
+@static_cell
+def device(text: str) -> gf.Component:
+    c = gf.Component()
+
+    _ = c << device_unlabeled()
+    _ = c << label(text)
+
+    return c
+
+
+def bond_pads() -> dict[str, tuple[float, float]]:
+    # centers of the z_cant_half wire bond pads, from the ports of the layout
+    return {port.name: port.center for port in device_unlabeled().ports}
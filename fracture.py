@@ -0,0 +1,123 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import concurrent.futures
+import os
+import tempfile
+
+from output import fork_context
+
+# GDS allows 8190 vertices per polygon, leave room for the closing point
+MAX_VERTICES = 8000
+
+# vertices closer than this to the line through their neighbors are removed,
+# output differs from the input by slivers no wider than twice this (um)
+TOLERANCE = 0.005
+
+# component shared with forked workers
+_COMPONENT = None
+
+
+def _size(polygon: kdb.Polygon) -> int:
+    # GDS has no holes, each hole is joined to the hull by a cut line
+    return polygon.num_points() + 2 * polygon.holes()
+
+
+def _bisect(region: kdb.Region, box: kdb.Box, max_vertices: int) -> kdb.Region:
+    small = kdb.Region()
+    large = kdb.Region()
+    for polygon in region.each():
+        if _size(polygon) > max_vertices:
+            large.insert(polygon)
+        else:
+            small.insert(polygon)
+
+    if large.is_empty():
+        return small
+
+    if box.width() >= box.height():
+        x = box.center().x
+        halves = [
+            kdb.Box(box.left, box.bottom, x, box.top),
+            kdb.Box(x, box.bottom, box.right, box.top),
+        ]
+    else:
+        y = box.center().y
+        halves = [
+            kdb.Box(box.left, box.bottom, box.right, y),
+            kdb.Box(box.left, y, box.right, box.top),
+        ]
+
+    for half in halves:
+        small += _bisect(large & kdb.Region(half), half, max_vertices)
+
+    return small
+
+
+def _fracture_layer(
+    layer: int,
+    max_vertices: int,
+    tolerance: int,
+    directory: str,
+) -> str:
+    original = kdb.Region(_COMPONENT.kdb_cell.begin_shapes_rec(layer))
+
+    # break at half the limit leaves room for the snapping of the cut points,
+    # the rare leftovers are cut into tiles by bisection
+    result = original.smoothed(tolerance, True)
+    result.merged_semantics = False
+    result.break_(max_vertices // 2, 0)
+    result = _bisect(result, result.bbox(), max_vertices)
+
+    if not (result ^ original).sized(-tolerance).is_empty():
+        raise ValueError(
+            f"Fracturing layer {layer} changed the geometry beyond tolerance"
+        )
+
+    layout = kdb.Layout()
+    layout.dbu = _COMPONENT.kcl.dbu
+    layout.create_cell("layer").shapes(layout.layer(0, 0)).insert(result)
+
+    path = os.path.join(directory, f"{layer}.oas")
+    layout.write(path)
+    return path
+
+
+def fracture(
+    component: gf.Component,
+    layers: list[gf.typings.Layer],
+    max_vertices: int = MAX_VERTICES,
+    tolerance: float = TOLERANCE,
+    workers: int | None = None,
+) -> None:
+    # fractures the layers of a flat component in place, one worker per layer
+    global _COMPONENT
+    _COMPONENT = component
+
+    layers = [gf.get_layer(layer) for layer in layers]
+    layers = [i for i in layers if not component.kdb_cell.bbox(i).empty()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=fork_context(),
+        ) as executor:
+            paths = list(
+                executor.map(
+                    _fracture_layer,
+                    layers,
+                    [max_vertices] * len(layers),
+                    [round(tolerance / component.kcl.dbu)] * len(layers),
+                    [directory] * len(layers),
+                )
+            )
+
+        for layer, path in zip(layers, paths):
+            layout = kdb.Layout()
+            layout.read(path)
+
+            shapes = component.kdb_cell.shapes(layer)
+            shapes.clear()
+            shapes.insert(
+                kdb.Region(layout.top_cell().begin_shapes_rec(layout.layer(0, 0)))
+            )
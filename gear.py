@@ -0,0 +1,235 @@
+import gdsfactory as gf
+import klayout.db as kdb
+import numpy as np
+
+import argparse
+import concurrent.futures
+import os
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from device import (
+    r_drive_half,
+    RDRIVE_MID_RADIUS,
+    RDRIVE_TEETH_CLEARANCE,
+    RDRIVE_TEETH_COUNT,
+    RDRIVE_TEETH_HEIGHT,
+    RDRIVE_TEETH_PHASE,
+)
+from model import DEVICE_THICKNESS, EPSILON_0, UM
+from output import fork_context
+from pdk import LAYERS
+
+# depth of the tooth tips used for the angular overlap (um), thin enough that
+# the flanks of the teeth don't count as facing area
+TIP_DEPTH = 0.2
+
+# vertices of the clipping circles
+CIRCLE_POINTS = 7200
+
+# angles per worker task
+ANGLE_CHUNK = 256
+
+# tooth tips shared with forked workers
+_ROTOR = None
+_STATORS = None
+
+
+def _ring(radius_inner: float, radius_outer: float, dbu: float) -> kdb.Region:
+    def disk(radius: float) -> kdb.Region:
+        box = kdb.DBox(-radius, -radius, radius, radius)
+        return kdb.Region(kdb.DPolygon.ellipse(box, CIRCLE_POINTS).to_itype(dbu))
+
+    return disk(radius_outer) - disk(radius_inner)
+
+
+def _radius(region: kdb.Region, extreme) -> float:
+    return extreme(
+        np.hypot(point.x, point.y)
+        for polygon in region.each()
+        for point in polygon.each_point_hull()
+    )
+
+
+def tips(
+    component: gf.Component,
+    layer: gf.typings.Layer = LAYERS.DEVICE,
+    remove_layer: gf.typings.Layer = LAYERS.DEVICE_REMOVE,
+    radius: float = RDRIVE_MID_RADIUS,
+    phases: list[float] = RDRIVE_TEETH_PHASE,
+    teeth_count: int = RDRIVE_TEETH_COUNT,
+) -> tuple[kdb.Region, dict[float, kdb.Region]]:
+    # rotor tooth tips and stator tooth tips of each phase, the stator is scaled
+    # onto the rotor tip radius so that overlap area / TIP_DEPTH is the facing
+    # arc length
+    cell = component.kdb_cell
+    dbu = component.kcl.dbu
+    device = kdb.Region(cell.begin_shapes_rec(gf.get_layer(layer))) - kdb.Region(
+        cell.begin_shapes_rec(gf.get_layer(remove_layer))
+    )
+
+    band = RDRIVE_TEETH_HEIGHT + RDRIVE_TEETH_CLEARANCE
+    rotor = device & _ring(radius - band, radius, dbu)
+    stator = device & _ring(radius, radius + band, dbu)
+    if rotor.is_empty() or stator.is_empty():
+        raise ValueError(f"No gear teeth found around radius {radius}")
+
+    rotor_radius = _radius(rotor, max) * dbu
+    stator_radius = _radius(stator, min) * dbu
+
+    rotor = rotor & _ring(rotor_radius - TIP_DEPTH, rotor_radius, dbu)
+    stator = (
+        stator & _ring(stator_radius, stator_radius + TIP_DEPTH, dbu)
+    ).transformed(
+        kdb.ICplxTrans(rotor_radius / (stator_radius + TIP_DEPTH), 0, False, 0, 0)
+    )
+
+    # phase of a stator tooth is its angular offset from the rotor teeth in
+    # units of the tooth pitch
+    def offset(polygon: kdb.Polygon) -> float:
+        center = polygon.bbox().center()
+        return (np.degrees(np.arctan2(center.y, center.x)) * teeth_count / 360) % 1
+
+    reference = offset(next(iter(rotor.each())))
+    stators = {phase: kdb.Region() for phase in phases}
+    for polygon in stator.each():
+        shift = ((offset(polygon) - reference) % 1) * 360
+        phase = min(phases, key=lambda p: abs((shift - p + 180) % 360 - 180))
+        stators[phase].insert(polygon)
+
+    return rotor, stators
+
+
+def _overlap(angles: np.ndarray) -> np.ndarray:
+    # (len(angles), phases) overlap area in dbu^2
+    result = np.zeros((len(angles), len(_STATORS)))
+    for i, angle in enumerate(angles):
+        rotor = _ROTOR.transformed(kdb.ICplxTrans(1, angle, False, 0, 0))
+        for j, stator in enumerate(_STATORS.values()):
+            result[i, j] = (rotor & stator).area()
+    return result
+
+
+def capacitance(
+    component: gf.Component,
+    angles: np.ndarray,
+    thickness: float = DEVICE_THICKNESS,
+    clearance: float = RDRIVE_TEETH_CLEARANCE,
+    workers: int | None = None,
+) -> dict[float, np.ndarray]:
+    # parallel plate capacitance in F between rotor and each stator phase at
+    # each rotor angle in degrees, fringe fields are neglected
+    global _ROTOR, _STATORS
+    _ROTOR, _STATORS = tips(component)
+
+    angles = np.asarray(angles, dtype=float)
+    chunks = [angles[i : i + ANGLE_CHUNK] for i in range(0, len(angles), ANGLE_CHUNK)]
+
+    # angle chunks per worker, workers inherit the tips by forking
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=fork_context(),
+    ) as executor:
+        area = np.concatenate(list(executor.map(_overlap, chunks))).reshape(
+            len(angles), len(_STATORS)
+        )
+
+    dbu = component.kcl.dbu
+    length = area * dbu**2 / TIP_DEPTH
+    c = EPSILON_0 * (thickness * UM) * (length * UM) / (clearance * UM)
+    return {phase: c[:, j] for j, phase in enumerate(_STATORS)}
+
+
+def torque(
+    angles: np.ndarray, capacitance: dict[float, np.ndarray], voltage: float
+) -> dict[float, np.ndarray]:
+    # torque in N*m of each phase driven alone, 0.5 * V^2 * dC/dtheta
+    theta = np.radians(np.asarray(angles, dtype=float))
+    return {
+        phase: 0.5 * voltage**2 * np.gradient(c, theta)
+        for phase, c in capacitance.items()
+    }
+
+
+def export(
+    path: str,
+    angles: np.ndarray,
+    capacitance: dict[float, np.ndarray],
+    torque: dict[float, np.ndarray],
+) -> None:
+    phases = list(capacitance)
+    with open(f"{path}.csv", "w") as f:
+        f.write(
+            "angle,"
+            + ",".join(f"capacitance_{phase:g}" for phase in phases)
+            + ","
+            + ",".join(f"torque_{phase:g}" for phase in phases)
+            + "\n"
+        )
+        for i, angle in enumerate(angles):
+            f.write(
+                f"{angle:.6f},"
+                + ",".join(f"{capacitance[phase][i]:.6e}" for phase in phases)
+                + ","
+                + ",".join(f"{torque[phase][i]:.6e}" for phase in phases)
+                + "\n"
+            )
+
+    fig, (ax0, ax1) = plt.subplots(2, 1, sharex=True)
+    for phase in phases:
+        ax0.plot(angles, capacitance[phase] * 1e15, label=f"phase {phase:g}")
+        ax1.plot(angles, torque[phase] * 1e9, label=f"phase {phase:g}")
+    ax0.set_ylabel("capacitance (fF)")
+    ax1.set_ylabel("torque (nN*m)")
+    ax1.set_xlabel("rotation (deg)")
+    ax0.legend()
+    ax0.set_title(os.path.basename(path))
+    fig.savefig(f"{path}.png", dpi=200)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Capacitance and torque vs rotation of the MEGA-PC R drive"
+    )
+    parser.add_argument(
+        "--angles",
+        action="store",
+        type=float,
+        nargs=3,
+        help="Rotation sweep START STOP COUNT in degrees",
+        default=(-8, 8, 1601),
+    )
+    parser.add_argument(
+        "--voltage",
+        action="store",
+        type=float,
+        help="Drive voltage",
+        default=100,
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        help="Worker processes, default all cores",
+        default=None,
+    )
+    parser.add_argument(
+        "--output",
+        action="store",
+        type=str,
+        help="Output path without extension",
+        default="./build/mega_pc_R_DRIVE",
+    )
+
+    args = parser.parse_args()
+
+    angles = np.linspace(args.angles[0], args.angles[1], int(args.angles[2]))
+    c = capacitance(r_drive_half(), angles, workers=args.workers)
+    t = torque(angles, c, args.voltage)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    export(args.output, angles, c, t)
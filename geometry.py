@@ -0,0 +1,14 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+
+def region(component: gf.Component, layer: gf.typings.Layer) -> kdb.Region:
+    # flat polygons of a layer in DBU, booleans and sizing chain on the region
+    # without creating intermediate cells
+    return kdb.Region(component.kdb_cell.begin_shapes_rec(gf.get_layer(layer)))
+
+
+def insert(
+    component: gf.Component, layer: gf.typings.Layer, region: kdb.Region
+) -> None:
+    component.kdb_cell.shapes(gf.get_layer(layer)).insert(region)
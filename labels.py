@@ -0,0 +1,59 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import hashlib
+import pathlib
+
+
+def digest(paths: list[str], *args: str) -> str:
+    # fingerprint of every source file that affects the label-free layout
+    h = hashlib.sha256()
+    for path in paths:
+        path = pathlib.Path(path)
+        files = sorted(path.rglob("*.py")) if path.is_dir() else [path]
+        for file in files:
+            h.update(file.read_bytes())
+    for arg in args:
+        h.update(arg.encode())
+    return h.hexdigest()[:16]
+
+
+def load(path: str, name: str) -> gf.Component:
+    layout = kdb.Layout()
+    layout.read(path)
+
+    c = gf.Component(name=name)
+    c.kdb_cell.copy_tree(layout.top_cell())
+
+    return c
+
+
+def patch(
+    component: gf.Component,
+    overlay: gf.Component,
+    layer: gf.typings.Layer,
+    tile: tuple[tuple[float, float], tuple[float, float]],
+    bias: float = 0,
+) -> None:
+    # merge the overlay into a flat component, only the part of the layer
+    # within the tile is re-merged, everything else is kept as is
+    layer_index = gf.get_layer(layer)
+    dbu = component.kcl.dbu
+
+    box = kdb.Region(kdb.DBox(*tile[0], *tile[1]).to_itype(dbu))
+    labels = kdb.Region(overlay.kdb_cell.begin_shapes_rec(layer_index))
+    if labels.is_empty():
+        return
+    if not (labels - box).is_empty():
+        raise ValueError("Overlay extends outside of the label tile")
+    if bias != 0:
+        labels.size(round(bias / dbu))
+
+    shapes = component.kdb_cell.shapes(layer_index)
+    base = kdb.Region(shapes)
+    # clipped to the tile, in merged mode DEVICE_REMOVE is a single die-sized
+    # polygon that interacts with every tile
+    patched = (base - box) + ((base & box) | labels)
+
+    shapes.clear()
+    shapes.insert(patched)
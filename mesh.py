@@ -0,0 +1,347 @@
+import klayout.db as kdb
+import mapbox_earcut as earcut
+import numpy as np
+
+import argparse
+import concurrent.futures
+import os
+import shutil
+import tempfile
+
+import output
+from pdk import STACK
+
+# tiles are meshed independently and streamed to the file in order (um)
+TILE_SIZE = 1000
+
+FORMATS = {"stl": ".stl", "msh": ".msh"}
+
+# layout and cell shared with forked workers
+_LAYOUT = None
+_CELL = None
+
+# geometry is scaled by 2 so that all of it sits on even coordinates and tile
+# seams on odd ones, walls along seams are then told apart from real walls
+_SCALE = 2
+
+
+def _region(layers: list | None, box: kdb.Box) -> kdb.Region:
+    # union of layers within a scaled box, None is the whole box
+    if layers is None:
+        return kdb.Region(box)
+
+    fetch = kdb.Box(
+        box.left // _SCALE - 1,
+        box.bottom // _SCALE - 1,
+        box.right // _SCALE + 1,
+        box.top // _SCALE + 1,
+    )
+    region = kdb.Region()
+    for layer in layers:
+        index = _LAYOUT.find_layer(layer.layer, layer.datatype)
+        if index is not None:
+            region.insert(_CELL.begin_shapes_rec_overlapping(index, fetch))
+    return region.transformed(kdb.ICplxTrans(_SCALE)) & kdb.Region(box)
+
+
+def _triangulate(region: kdb.Region) -> np.ndarray:
+    # (n, 3, 2) triangles clockwise seen from above, ear clipping adds no points
+    # so the caps share every vertex with the walls and the neighboring tiles
+    triangles = []
+    for polygon in region.each():
+        rings = [[(p.x, p.y) for p in polygon.each_point_hull()]]
+        for hole in range(polygon.holes()):
+            rings.append([(p.x, p.y) for p in polygon.each_point_hole(hole)])
+
+        vertices = np.array([p for ring in rings for p in ring], dtype=np.float64)
+        ends = np.cumsum([len(ring) for ring in rings]).astype(np.uint32)
+        triangles.append(vertices[earcut.triangulate_float64(vertices, ends)])
+
+    points = np.concatenate(triangles).reshape(-1, 3, 2)
+
+    a, b, c = points[:, 0], points[:, 1], points[:, 2]
+    ccw = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (
+        c[:, 0] - a[:, 0]
+    ) > 0
+    points[ccw] = points[ccw][:, ::-1]
+    return points
+
+
+def _caps(points: np.ndarray, bottom: float, top: float) -> np.ndarray:
+    # bottom faces down, so it keeps the clockwise order
+    triangles = np.empty((2 * len(points), 3, 3))
+    triangles[: len(points), :, :2] = points
+    triangles[: len(points), :, 2] = bottom
+    triangles[len(points) :, :, :2] = points[:, ::-1]
+    triangles[len(points) :, :, 2] = top
+    return triangles
+
+
+def _walls(points: np.ndarray, bottom: float, top: float) -> np.ndarray:
+    # outline of the triangles, edges used by a single triangle
+    edges = np.concatenate(
+        [points[:, [0, 1]], points[:, [1, 2]], points[:, [2, 0]]]
+    ).reshape(-1, 4)
+    key = np.where(
+        (edges[:, [0]] < edges[:, [2]])
+        | ((edges[:, [0]] == edges[:, [2]]) & (edges[:, [1]] < edges[:, [3]])),
+        edges,
+        edges[:, [2, 3, 0, 1]],
+    )
+    _, inverse, counts = np.unique(key, axis=0, return_inverse=True, return_counts=True)
+    edges = edges[counts[inverse.ravel()] == 1]
+
+    # edges along tile seams are not walls
+    seam = ((edges[:, 0] == edges[:, 2]) & (edges[:, 0] % 2 == 1)) | (
+        (edges[:, 1] == edges[:, 3]) & (edges[:, 1] % 2 == 1)
+    )
+    x1, y1, x2, y2 = edges[~seam].T
+
+    # interior is right of each edge, triangles wind counterclockwise from outside
+    p1b = np.stack([x1, y1, np.full_like(x1, bottom)], axis=1)
+    p2b = np.stack([x2, y2, np.full_like(x1, bottom)], axis=1)
+    p1t = np.stack([x1, y1, np.full_like(x1, top)], axis=1)
+    p2t = np.stack([x2, y2, np.full_like(x1, top)], axis=1)
+    return np.concatenate(
+        [np.stack([p1b, p2t, p2b], axis=1), np.stack([p1b, p1t, p2t], axis=1)]
+    )
+
+
+def _mesh(body: str, box: kdb.Box) -> np.ndarray:
+    # (n, 3, 3) triangles in um of one body within one scaled tile
+    z, thickness, layers, removed = STACK[body]
+    material = _region(layers, box) - _region(removed or [], box)
+    if material.is_empty():
+        return np.zeros((0, 3, 3), dtype=np.float32)
+
+    # z is scaled along with x and y, then everything returns to um together
+    scale = _LAYOUT.dbu / _SCALE
+    bottom, top = z / scale, (z + thickness) / scale
+    points = _triangulate(material)
+    triangles = np.concatenate(
+        [_caps(points, bottom, top), _walls(points, bottom, top)]
+    )
+    return (triangles * scale).astype(np.float32)
+
+
+class _Stl:
+    # binary STL, the triangle count is patched in on close
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "wb")
+        self.file.write(b"MEGA-PC".ljust(80, b"\0"))
+        self.file.write(np.uint32(0).tobytes())
+        self.count = 0
+
+    def write(self, triangles: np.ndarray, body: int) -> None:
+        record = np.zeros(
+            len(triangles),
+            dtype=[("normal", "<f4", 3), ("vertices", "<f4", (3, 3)), ("attr", "<u2")],
+        )
+        normal = np.cross(
+            triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+        )
+        length = np.linalg.norm(normal, axis=1, keepdims=True)
+        record["normal"] = normal / np.where(length > 0, length, 1)
+        record["vertices"] = triangles
+        record["attr"] = body
+        record.tofile(self.file)
+        self.count += len(triangles)
+
+    def close(self) -> None:
+        self.file.seek(80)
+        self.file.write(np.uint32(self.count).tobytes())
+        self.file.close()
+
+
+class _Msh:
+    # binary GMSH 2.2 with one physical surface per body, nodes and elements
+    # are streamed to temporary files and joined on close. Coincident vertices
+    # share one node, within and across tiles and bodies
+    def __init__(self, path: str, bodies: list[str]) -> None:
+        self.path = path
+        self.bodies = bodies
+        self.directory = tempfile.TemporaryDirectory()
+        self.nodes = open(os.path.join(self.directory.name, "nodes"), "wb")
+        self.elements = open(os.path.join(self.directory.name, "elements"), "wb")
+        self.ids = {}
+        self.count = 0
+
+    def write(self, triangles: np.ndarray, body: int) -> None:
+        n = len(triangles)
+        if n == 0:
+            return
+
+        # adding 0 turns -0.0 into 0.0, so equal coordinates have equal keys
+        vertices = triangles.reshape(-1, 3).astype("<f8") + 0.0
+        unique, inverse = np.unique(vertices, axis=0, return_inverse=True)
+        keys = np.ascontiguousarray(unique).view(np.dtype((np.void, 24))).ravel()
+
+        ids = np.empty(len(unique), dtype=np.int32)
+        new = []
+        for k, key in enumerate(keys.tolist()):
+            if key not in self.ids:
+                self.ids[key] = len(self.ids) + 1
+                new.append(k)
+            ids[k] = self.ids[key]
+
+        nodes = np.zeros(len(new), dtype=[("id", "<i4"), ("xyz", "<f8", 3)])
+        nodes["id"] = ids[new]
+        nodes["xyz"] = unique[new]
+        nodes.tofile(self.nodes)
+
+        # element type 2 is a 3-node triangle, tags are physical and elementary
+        np.array([2, n, 2], dtype="<i4").tofile(self.elements)
+        elements = np.empty((n, 6), dtype="<i4")
+        elements[:, 0] = self.count + 1 + np.arange(n)
+        elements[:, 1] = body + 1
+        elements[:, 2] = body + 1
+        elements[:, 3:] = ids[inverse.ravel()].reshape(n, 3)
+        elements.tofile(self.elements)
+
+        self.count += n
+
+    def close(self) -> None:
+        self.nodes.close()
+        self.elements.close()
+
+        with open(self.path, "wb") as f:
+            f.write(b"$MeshFormat\n2.2 1 8\n")
+            f.write(np.int32(1).tobytes())
+            f.write(b"\n$EndMeshFormat\n$PhysicalNames\n")
+            f.write(f"{len(self.bodies)}\n".encode())
+            for i, body in enumerate(self.bodies):
+                f.write(f'2 {i + 1} "{body}"\n'.encode())
+            f.write(b"$EndPhysicalNames\n")
+
+            f.write(f"$Nodes\n{len(self.ids)}\n".encode())
+            with open(self.nodes.name, "rb") as nodes:
+                shutil.copyfileobj(nodes, f)
+            f.write(f"\n$EndNodes\n$Elements\n{self.count}\n".encode())
+            with open(self.elements.name, "rb") as elements:
+                shutil.copyfileobj(elements, f)
+            f.write(b"\n$EndElements\n")
+
+        self.directory.cleanup()
+
+
+def export(
+    path: str,
+    layout: kdb.Layout,
+    cell: kdb.Cell | None = None,
+    box: kdb.DBox | None = None,
+    bodies: list[str] | None = None,
+    format: str = "stl",
+    tile_size: float = TILE_SIZE,
+    workers: int | None = None,
+) -> str:
+    # extrudes the STACK bodies of a cell (default the top cell) within a box in
+    # um (default the cell bbox), path is without extension
+    global _LAYOUT, _CELL
+    _LAYOUT = layout
+    _CELL = cell or layout.top_cell()
+
+    bodies = bodies or list(STACK)
+    box = (box.to_itype(layout.dbu) if box is not None else _CELL.bbox()) * _SCALE
+
+    # tile seams are odd, the outer boundary is even and is kept as walls
+    step = _SCALE * round(tile_size / layout.dbu)
+    xs = [box.left, *range(box.left + step + 1, box.right, step), box.right]
+    ys = [box.bottom, *range(box.bottom + step + 1, box.top, step), box.top]
+    tiles = [
+        kdb.Box(x0, y0, x1, y1)
+        for x0, x1 in zip(xs[:-1], xs[1:])
+        for y0, y1 in zip(ys[:-1], ys[1:])
+    ]
+    tasks = [(i, tile) for i in range(len(bodies)) for tile in tiles]
+
+    path = f"{path}{FORMATS[format]}"
+    mesh = _Stl(path) if format == "stl" else _Msh(path, bodies)
+
+    # tiles per worker, workers inherit the layout by forking
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=output.fork_context(),
+    ) as executor:
+        for (i, _), triangles in zip(
+            tasks,
+            executor.map(
+                _mesh,
+                [bodies[i] for i, _ in tasks],
+                [tile for _, tile in tasks],
+                chunksize=4,
+            ),
+        ):
+            mesh.write(triangles, i)
+
+    mesh.close()
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="3D mesh export for MEGA-PC")
+    parser.add_argument(
+        "file",
+        help="SOURCE GDS/OASIS file to export",
+    )
+    parser.add_argument(
+        "--format",
+        action="store",
+        type=str,
+        choices=FORMATS,
+        help="Binary STL or binary GMSH 2.2 with one physical surface per body",
+        default="stl",
+    )
+    parser.add_argument(
+        "--cell",
+        action="store",
+        type=str,
+        help="Export this cell (e.g. center_carriage) in its own coordinates instead of the top cell",
+        default=None,
+    )
+    parser.add_argument(
+        "--box",
+        action="store",
+        type=float,
+        nargs=4,
+        help="Export only LEFT BOTTOM RIGHT TOP in um",
+        default=None,
+    )
+    parser.add_argument(
+        "--body",
+        action="append",
+        type=str,
+        choices=STACK,
+        help="STACK body to export, can be repeated, default all",
+        default=None,
+    )
+    parser.add_argument(
+        "--tile-size",
+        action="store",
+        type=float,
+        help="Tile size in um",
+        default=TILE_SIZE,
+    )
+
+    args = parser.parse_args()
+
+    layout = kdb.Layout()
+    layout.read(args.file)
+
+    cell = None
+    if args.cell is not None:
+        cell = layout.cell(args.cell)
+        if cell is None:
+            raise ValueError(f"Cell {args.cell} not found in {args.file}")
+
+    stem = output.stem(args.file)
+    print(
+        export(
+            f"{stem}_MESH" if args.cell is None else f"{stem}_MESH_{args.cell}",
+            layout,
+            cell=cell,
+            box=kdb.DBox(*args.box) if args.box is not None else None,
+            bodies=args.body,
+            format=args.format,
+            tile_size=args.tile_size,
+        )
+    )
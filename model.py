@@ -0,0 +1,176 @@
+import numpy as np
+
+from device import (
+    RFLEX_INNER_RADIUS1,
+    RFLEX_ANCHOR_RADIUS0,
+    RFLEX_BEAM_WIDTH,
+    RFLEX_BEAM_SPEC,
+    RFLEX_BEAM_ANGLES,
+    RDRIVE_MID_RADIUS,
+    RDRIVE_TEETH_CLEARANCE,
+    RDRIVE_TEETH_PHASE,
+    RDRIVE_TEETH_COUNT,
+    RDRIVE_ROTOR_SPAN,
+    ZCANT_BEAM0_WIDTH,
+    ZCANT_BEAM0_LENGTH,
+    ZCANT_BEAM1_WIDTH,
+    ZCANT_BEAM1_LENGTH,
+    ZCANT_BEAM2_WIDTH,
+    ZCANT_BEAM2_LENGTH,
+)
+from pdk import STACK
+
+# all lengths in um, results in SI units (N/m, N*m/rad, N*m)
+E_SILICON = 169e9
+EPSILON_0 = 8.854e-12
+DEVICE_THICKNESS = STACK["DEVICE"][1]
+
+UM = 1e-6
+
+
+def _beam_length(radius_inner, radius_outer):
+    # only the thin part of the beam bends, the thick part is rigid
+    thick = RFLEX_BEAM_SPEC.thick_length[1] - RFLEX_BEAM_SPEC.thick_length[0]
+    return (1 - thick) * (radius_outer - radius_inner)
+
+
+def flexure_radial_stiffness(
+    width=RFLEX_BEAM_WIDTH,
+    radius_inner=RFLEX_INNER_RADIUS1,
+    radius_outer=RFLEX_ANCHOR_RADIUS0,
+    angles=RFLEX_BEAM_ANGLES,
+    thickness=DEVICE_THICKNESS,
+):
+    # in-plane translation stiffness along x and y of the two r_flexure_half,
+    # each beam is axially stiff and guided in bending
+    width = np.asarray(width, dtype=float) * UM
+    thickness = np.asarray(thickness, dtype=float) * UM
+    length = np.asarray(_beam_length(radius_inner, radius_outer), dtype=float) * UM
+
+    k_axial = E_SILICON * width * thickness / length
+    k_bend = E_SILICON * thickness * width**3 / length**3
+
+    # flexures point along +y and -y, beams are symmetric about that axis
+    k_x = np.zeros_like(k_axial)
+    k_y = np.zeros_like(k_axial)
+    for angle in angles:
+        for phi in [90 - angle, 90 + angle, 270 - angle, 270 + angle]:
+            c, s = np.cos(np.deg2rad(phi)), np.sin(np.deg2rad(phi))
+            k_x = k_x + k_axial * c**2 + k_bend * s**2
+            k_y = k_y + k_axial * s**2 + k_bend * c**2
+
+    return k_x, k_y
+
+
+def flexure_rotational_stiffness(
+    width=RFLEX_BEAM_WIDTH,
+    radius_inner=RFLEX_INNER_RADIUS1,
+    radius_outer=RFLEX_ANCHOR_RADIUS0,
+    angles=RFLEX_BEAM_ANGLES,
+    thickness=DEVICE_THICKNESS,
+):
+    # rotation about the center, each beam is clamped to a rigid hub
+    width = np.asarray(width, dtype=float) * UM
+    thickness = np.asarray(thickness, dtype=float) * UM
+    length = np.asarray(_beam_length(radius_inner, radius_outer), dtype=float) * UM
+    hub = np.asarray(radius_outer, dtype=float) * UM - length
+
+    inertia = thickness * width**3 / 12
+    k_beam = (4 * E_SILICON * inertia / length) * (
+        1 + 3 * hub / length + 3 * hub**2 / length**2
+    )
+
+    return 4 * len(angles) * k_beam
+
+
+def z_stiffness(
+    widths=(ZCANT_BEAM0_WIDTH, ZCANT_BEAM1_WIDTH, ZCANT_BEAM2_WIDTH),
+    lengths=(ZCANT_BEAM0_LENGTH, ZCANT_BEAM1_LENGTH, ZCANT_BEAM2_LENGTH),
+    thickness=DEVICE_THICKNESS,
+    count=8,
+):
+    # out-of-plane stiffness of count z_cant_half, the beams act in parallel and
+    # are guided at both ends
+    thickness = np.asarray(thickness, dtype=float) * UM
+    k = 0
+    for width, length in zip(widths, lengths):
+        width = np.asarray(width, dtype=float) * UM
+        length = np.asarray(length, dtype=float) * UM
+        k = k + E_SILICON * width * thickness**3 / length**3
+
+    return count * k
+
+
+def gear_torque(
+    voltage,
+    radius=RDRIVE_MID_RADIUS,
+    clearance=RDRIVE_TEETH_CLEARANCE,
+    teeth_count=RDRIVE_TEETH_COUNT,
+    rotor_span=RDRIVE_ROTOR_SPAN,
+    phases=len(RDRIVE_TEETH_PHASE),
+    thickness=DEVICE_THICKNESS,
+):
+    # peak torque of one driven phase while its teeth are partially overlapped,
+    # dC/dtheta of each tooth pair is eps0 * t * r / gap
+    voltage = np.asarray(voltage, dtype=float)
+    radius = np.asarray(radius, dtype=float) * UM
+    clearance = np.asarray(clearance, dtype=float) * UM
+    thickness = np.asarray(thickness, dtype=float) * UM
+
+    # both r_drive_half, teeth count is per full circle
+    teeth = 2 * np.asarray(teeth_count) * np.asarray(rotor_span) / 360 / phases
+
+    return 0.5 * voltage**2 * teeth * EPSILON_0 * thickness * radius / clearance
+
+
+def evaluate(voltage=100, **params) -> dict[str, np.ndarray]:
+    # every model over broadcast parameter arrays, e.g.
+    # evaluate(width=np.linspace(2, 6, 1000)[:, None], thickness=[20, 25, 30])
+    flexure = {
+        key: params[key]
+        for key in ["width", "radius_inner", "radius_outer", "thickness"]
+        if key in params
+    }
+    k_x, k_y = flexure_radial_stiffness(**flexure)
+
+    torque = gear_torque(
+        voltage,
+        **{
+            key: params[key]
+            for key in ["radius", "clearance", "teeth_count", "thickness"]
+            if key in params
+        },
+    )
+    k_rot = flexure_rotational_stiffness(**flexure)
+
+    results = {
+        "k_x": k_x,
+        "k_y": k_y,
+        "k_rot": k_rot,
+        "k_z": z_stiffness(
+            **{key: params[key] for key in ["thickness"] if key in params}
+        ),
+        "torque": torque,
+        # static rotation of the gear against the flexure
+        "rotation": np.rad2deg(torque / k_rot),
+    }
+    return {key: np.asarray(value) for key, value in results.items()}
+
+
+def select(
+    results: dict[str, np.ndarray],
+    count: int,
+    key: str,
+    **limits: tuple[float, float],
+) -> np.ndarray:
+    # flat indices of the count best designs by key within (min, max) limits,
+    # feeds the sweep points of a layout sweep
+    shape = np.broadcast_shapes(*(value.shape for value in results.values()))
+    mask = np.ones(shape, dtype=bool)
+    for name, (low, high) in limits.items():
+        value = np.broadcast_to(results[name], shape)
+        mask &= (value >= low) & (value <= high)
+
+    score = np.where(mask, np.broadcast_to(results[key], shape), -np.inf).ravel()
+    order = np.argsort(score)[::-1][:count]
+    return order[np.isfinite(score[order])]
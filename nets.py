@@ -0,0 +1,147 @@
+import gdsfactory as gf
+import klayout.db as kdb
+import numpy as np
+
+import json
+
+
+class _UnionFind:
+    def __init__(self, n: int) -> None:
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        self.parent[self.find(i)] = self.find(j)
+
+
+class Nets:
+    # conductors are merged per layer, each polygon is a node, connectors join
+    # the nodes of two layers they both interact with
+    def __init__(
+        self,
+        conductors: dict[str, kdb.Region],
+        connectors: list[tuple[kdb.Region, str, str]],
+        dbu: float,
+    ) -> None:
+        self.dbu = dbu
+        self.polygons = []
+        self.layers = []
+        for name, region in conductors.items():
+            for polygon in region.merged().each():
+                self.polygons.append(polygon)
+                self.layers.append(name)
+
+        # bounding box index, (n, 4) as left, bottom, right, top
+        self._boxes = np.array(
+            [
+                (p.bbox().left, p.bbox().bottom, p.bbox().right, p.bbox().top)
+                for p in self.polygons
+            ]
+        ).reshape(-1, 4)
+        self._layers = np.array(self.layers)
+        self._uf = _UnionFind(len(self.polygons))
+
+        for region, layer_a, layer_b in connectors:
+            for via in region.merged().each():
+                nodes = [
+                    int(i)
+                    for i in self._candidates(via.bbox(), (layer_a, layer_b))
+                    if self.polygons[i].touches(via)
+                ]
+                if {self.layers[i] for i in nodes} != {layer_a, layer_b}:
+                    # a via that misses either layer connects nothing
+                    continue
+                for i in nodes[1:]:
+                    self._uf.union(nodes[0], i)
+
+    def _candidates(self, box: kdb.Box, layers: tuple[str, ...]) -> np.ndarray:
+        mask = (
+            (self._boxes[:, 0] <= box.right)
+            & (self._boxes[:, 2] >= box.left)
+            & (self._boxes[:, 1] <= box.top)
+            & (self._boxes[:, 3] >= box.bottom)
+            & np.isin(self._layers, layers)
+        )
+        return np.nonzero(mask)[0]
+
+    def net(self, point: tuple[float, float], layer: str) -> int | None:
+        # net id at a point in um, None if the point is not on a conductor
+        p = kdb.DPoint(*point).to_itype(self.dbu)
+        for i in self._candidates(kdb.Box(p, p), (layer,)):
+            if self.polygons[i].inside(p):
+                return self._uf.find(int(i))
+        return None
+
+    def nets(self, pads: dict[str, tuple[float, float]], layer: str) -> dict[str, int]:
+        return {name: self.net(point, layer) for name, point in pads.items()}
+
+
+def check(
+    nets: dict[str, int | None],
+    netlist: dict[str, list[str]],
+) -> list[str]:
+    # opens: pads of one declared net on different nets, shorts: pads of
+    # different declared nets on the same net
+    errors = []
+    owner = {}
+    for name, pads in netlist.items():
+        for pad in pads:
+            if nets.get(pad) is None:
+                errors.append(f"{name}: pad {pad} is not on a conductor")
+
+        found = {nets[pad] for pad in pads if nets.get(pad) is not None}
+        if len(found) > 1:
+            errors.append(f"{name}: open, pads {', '.join(pads)} are not connected")
+
+        for net in found:
+            if net in owner and owner[net] != name:
+                errors.append(f"{name}: short to {owner[net]}")
+            owner[net] = name
+
+    return errors
+
+
+def load(path: str) -> dict[str, list[str]]:
+    # JSON object of net name to the list of bond pads on the net
+    with open(path) as f:
+        return json.load(f)
+
+
+def chip(
+    component: gf.Component,
+    device_layer: gf.typings.Layer,
+    remove_layer: gf.typings.Layer,
+    handle_remove_layer: gf.typings.Layer,
+    via_layers: list[gf.typings.Layer],
+    merged: bool = True,
+) -> Nets:
+    # DEVICE and HANDLE silicon of a flat chip, joined by the via stacks. A via
+    # is the nested stack of via_layers (etch, poly fill and the dielectric
+    # openings around it), it only conducts where every layer of the stack is
+    # present, e.g. an etch without its poly fill joins nothing
+    cell = component.kdb_cell
+
+    def region(layer: gf.typings.Layer) -> kdb.Region:
+        return kdb.Region(cell.begin_shapes_rec(gf.get_layer(layer)))
+
+    chip_region = kdb.Region(cell.bbox())
+    if merged:
+        device = chip_region - region(remove_layer)
+    else:
+        device = region(device_layer) - region(remove_layer)
+    handle = chip_region - region(handle_remove_layer)
+
+    vias = region(via_layers[0])
+    for layer in via_layers[1:]:
+        vias &= region(layer)
+
+    return Nets(
+        conductors={"DEVICE": device, "HANDLE": handle},
+        connectors=[(vias, "DEVICE", "HANDLE")],
+        dbu=component.kcl.dbu,
+    )
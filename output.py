@@ -0,0 +1,328 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import concurrent.futures
+import hashlib
+import multiprocessing
+import os
+import pathlib
+import threading
+import weakref
+
+from gdsfactory.component import _fix_pin_metadata, save_layout_options
+
+import dedup
+
+# file extension for each output format
+FORMATS = {
+    "gds": ".gds",
+    "gds.gz": ".gds.gz",
+    "oas": ".oas",
+}
+
+# 0 disables repetition detection, 10 is the most thorough search
+OASIS_COMPRESSION_LEVEL = 10
+
+# name gdsfactory gives to cells of components without a name
+ANONYMOUS_PREFIX = "Unnamed_"
+
+# writers whose threads are stopped before any fork
+_WRITERS = weakref.WeakSet()
+
+
+def fork_context() -> multiprocessing.context.BaseContext:
+    # fork start method for pools whose workers inherit a layout. Forking while
+    # other threads run can deadlock the child (deprecated since Python 3.12),
+    # so the pending writes are finished and the writer threads stopped first
+    for writer in list(_WRITERS):
+        writer.drain()
+    return multiprocessing.get_context("fork")
+
+
+def stem(path: str) -> str:
+    # path without its layout format suffix, versions may contain dots
+    for suffix in sorted(FORMATS.values(), key=len, reverse=True):
+        if path.endswith(suffix):
+            return path.removesuffix(suffix)
+    return os.path.splitext(path)[0]
+
+
+def options(
+    format: str, with_metadata: bool = False, deterministic: bool = False
+) -> kdb.SaveLayoutOptions:
+    if format not in FORMATS:
+        raise ValueError(f"Unknown output format '{format}'")
+
+    if format == "oas":
+        save_options = save_layout_options(
+            format="OASIS",
+            oasis_compression_level=OASIS_COMPRESSION_LEVEL,
+            oasis_write_cblocks=True,
+            oasis_strict_mode=True,
+        )
+    else:
+        # KLayout gzips the stream based on the ".gz" suffix
+        save_options = save_layout_options(format="GDS2")
+
+    if not with_metadata:
+        save_options.write_context_info = False
+
+    if deterministic:
+        # GDS2 headers carry the write time by default
+        save_options.gds2_write_timestamps = False
+
+    return save_options
+
+
+def stabilize(layout: kdb.Layout) -> int:
+    # renames anonymous gdsfactory cells ("Unnamed_N", numbered in creation
+    # order) after their geometry, returns the number of renamed cells
+    cache = {}
+    renamed = 0
+    for index in layout.each_cell_bottom_up():
+        cell = layout.cell(index)
+        if not cell.name.startswith(ANONYMOUS_PREFIX):
+            continue
+
+        key = dedup.fingerprint(cell, cache)[:16]
+        name = f"{ANONYMOUS_PREFIX}{key}"
+        suffix = 1
+        while layout.has_cell(name) and layout.cell_by_name(name) != index:
+            name = f"{ANONYMOUS_PREFIX}{key}_{suffix}"
+            suffix += 1
+        cell.name = name
+        renamed += 1
+
+    return renamed
+
+
+def write(
+    component: gf.Component,
+    path: str,
+    format: str = "gds",
+    with_metadata: bool = False,
+) -> pathlib.Path:
+    save_options = options(format, with_metadata)
+    return component.write_gds(
+        f"{path}{FORMATS[format]}",
+        save_options=save_options,
+        with_metadata=with_metadata,
+    )
+
+
+class Writer:
+    # writes finished artifacts on a thread pool while the build continues,
+    # at most max_pending snapshots are held in memory at once. Deterministic
+    # files are byte-stable across builds of the same sources: no timestamps
+    # and anonymous cells named after their geometry
+    def __init__(
+        self, workers: int = 4, max_pending: int = 4, deterministic: bool = False
+    ) -> None:
+        self._deterministic = deterministic
+        self._workers = workers
+        self._max_pending = max_pending
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = {}
+        self._paths = set()
+        _WRITERS.add(self)
+
+    def _check(self, path: str) -> None:
+        # a second write to a path would replace the first future, losing its
+        # checksum and errors
+        if os.path.abspath(path) in self._paths:
+            raise ValueError(f"{path} is already written by this build")
+
+    def _submit(self, path: str, func, *args) -> None:
+        self._check(path)
+        self._paths.add(os.path.abspath(path))
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._workers
+            )
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(func, path, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures[path] = future
+
+    @staticmethod
+    def _sync(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+            os.fsync(f.fileno())
+        return h.hexdigest()
+
+    @staticmethod
+    def _partial(path: str) -> str:
+        # same directory and suffix, renamed into place once complete so that
+        # concurrent builds never read a partially written file
+        head, tail = os.path.split(path)
+        return os.path.join(head, f".{os.getpid()}.{tail}")
+
+    @staticmethod
+    def _write_layout(
+        path: str,
+        layout: kdb.Layout,
+        save_options: kdb.SaveLayoutOptions,
+        deduplicate: bool = False,
+    ) -> str:
+        if deduplicate:
+            dedup.deduplicate(layout)
+
+        partial = Writer._partial(path)
+        layout.write(partial, save_options)
+        checksum = Writer._sync(partial)
+        os.replace(partial, path)
+        return checksum
+
+    @staticmethod
+    def _write_child(
+        path: str, layout: kdb.Layout, save_options: kdb.SaveLayoutOptions
+    ) -> None:
+        layout.write(path, save_options)
+
+    @staticmethod
+    def _join_process(path: str, process: multiprocessing.Process, partial: str) -> str:
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Writer process exited with code {process.exitcode}")
+
+        checksum = Writer._sync(partial)
+        os.replace(partial, path)
+        return checksum
+
+    @staticmethod
+    def _snapshot(component: gf.Component, with_metadata: bool) -> kdb.Layout:
+        # private copy of the component, so it can be modified (e.g. mirrored)
+        # while the copy is written. Metadata (ports, settings, info) is copied
+        # as the persisted meta info gdsfactory would write
+        layout = kdb.Layout()
+        layout.dbu = component.kcl.dbu
+        layout.create_cell(component.name).copy_tree(component.kdb_cell)
+        if not with_metadata:
+            return layout
+
+        # same preparation as gf.Component.write
+        kcl = component.kcl
+        kcl.set_meta_data()
+        for info in kcl.layout.each_meta_info():
+            layout.add_meta_info(info)
+        for index in [*component.called_cells(), component.cell_index()]:
+            kcell = kcl[index]
+            if kcell._destroyed():
+                continue
+            kcell.set_meta_data()
+            _fix_pin_metadata(kcell)
+            source = kcl.layout.cell(index)
+            target = layout.cell(source.name)
+            for info in source.each_meta_info():
+                target.add_meta_info(info)
+        return layout
+
+    @staticmethod
+    def _write_data(path: str, data: bytes) -> str:
+        partial = Writer._partial(path)
+        with open(partial, "wb") as f:
+            f.write(data)
+        checksum = Writer._sync(partial)
+        os.replace(partial, path)
+        return checksum
+
+    def write(
+        self,
+        component: gf.Component,
+        path: str,
+        format: str = "gds",
+        with_metadata: bool = False,
+        deduplicate: bool = False,
+        process: bool = False,
+    ) -> None:
+        # deduplicate merges geometrically identical cells in the written file,
+        # process writes from a forked child for large layouts
+        component.insert_vinsts()
+        layout = self._snapshot(component, with_metadata)
+        if self._deterministic:
+            stabilize(layout)
+
+        save_options = options(format, with_metadata, self._deterministic)
+        if process:
+            # KLayout holds the GIL while writing, a child forked from this
+            # thread inherits the snapshot so that large layouts are written in
+            # parallel, at most max_pending children run at once
+            if deduplicate:
+                dedup.deduplicate(layout)
+            path = f"{path}{FORMATS[format]}"
+            self._check(path)
+            children = [
+                key for key, value in self._futures.items() if type(value) is tuple
+            ]
+            for key in children[: max(0, len(children) - self._max_pending + 1)]:
+                self._reap(key)
+
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            partial = self._partial(path)
+            child = fork_context().Process(
+                target=self._write_child, args=(partial, layout, save_options)
+            )
+            child.start()
+            self._paths.add(os.path.abspath(path))
+            self._futures[path] = (child, partial)
+        else:
+            self._submit(
+                f"{path}{FORMATS[format]}",
+                self._write_layout,
+                layout,
+                save_options,
+                deduplicate,
+            )
+
+    def text(self, path: str, text: str) -> None:
+        self._submit(path, self._write_data, text.encode())
+
+    def data(self, path: str, data: bytes) -> None:
+        self._submit(path, self._write_data, data)
+
+    def _reap(self, path: str) -> None:
+        # waits for a writer child, its result is kept as a finished future
+        child, partial = self._futures[path]
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(self._join_process(path, child, partial))
+        except Exception as e:
+            future.set_exception(e)
+        self._futures[path] = future
+
+    def drain(self) -> None:
+        # finishes the pending writes and stops the threads, results are kept
+        # for wait
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def wait(self) -> dict[str, str]:
+        # barrier, returns the sha256 of every written file
+        for path, value in list(self._futures.items()):
+            if type(value) is tuple:
+                self._reap(path)
+
+        checksums = {}
+        errors = []
+        for path, future in self._futures.items():
+            try:
+                checksums[path] = future.result()
+            except Exception as e:
+                errors.append(f"{path}: {e!r}")
+        self.drain()
+        self._futures = {}
+
+        if errors:
+            raise RuntimeError("Failed to write:\n" + "\n".join(errors))
+
+        return checksums
@@ -0,0 +1,229 @@
+import numpy as np
+
+import argparse
+import functools
+
+# ASML exposure field at wafer scale, centered on the reticle origin (um)
+RETICLE_FIELD = (26000, 33000)
+
+# areas of the field taken by the reticle frame, LEFT BOTTOM RIGHT TOP (um),
+# reticle.assemble passes the features of the gb frame instead
+RETICLE_EXCLUSIONS = []
+
+# chrome between images for the masking blades (um)
+IMAGE_SPACING = 500
+
+# candidate image centers are snapped to this grid (um)
+GRID = 50
+
+
+@functools.cache
+def _candidates(
+    size: tuple[float, float],
+    field: tuple[float, float],
+    exclusions: tuple[tuple[float, float, float, float], ...],
+    spacing: float,
+    grid: float,
+) -> np.ndarray:
+    # (n, 2) centers of an image inside the field and clear of the exclusions
+    w, h = size
+    xs = np.arange(-0.5 * (field[0] - w) // grid, 0.5 * (field[0] - w) // grid + 1)
+    ys = np.arange(-0.5 * (field[1] - h) // grid, 0.5 * (field[1] - h) // grid + 1)
+    centers = np.stack(np.meshgrid(xs * grid, ys * grid), axis=-1).reshape(-1, 2)
+    centers = centers[
+        (np.abs(centers[:, 0]) + 0.5 * w <= 0.5 * field[0])
+        & (np.abs(centers[:, 1]) + 0.5 * h <= 0.5 * field[1])
+    ]
+
+    for left, bottom, right, top in exclusions:
+        clear = (
+            (centers[:, 0] + 0.5 * w + spacing <= left)
+            | (centers[:, 0] - 0.5 * w - spacing >= right)
+            | (centers[:, 1] + 0.5 * h + spacing <= bottom)
+            | (centers[:, 1] - 0.5 * h - spacing >= top)
+        )
+        centers = centers[clear]
+
+    return centers
+
+
+def _clear(
+    centers: np.ndarray,
+    size: tuple[float, float],
+    placed: list[tuple[float, float, float, float]],
+    spacing: float,
+) -> np.ndarray:
+    # candidates that keep the spacing to every placed image (x, y, w, h)
+    clear = np.ones(len(centers), dtype=bool)
+    for x, y, w, h in placed:
+        clear &= (np.abs(centers[:, 0] - x) >= 0.5 * (w + size[0]) + spacing) | (
+            np.abs(centers[:, 1] - y) >= 0.5 * (h + size[1]) + spacing
+        )
+    return clear
+
+
+def _moves(points: np.ndarray) -> float:
+    return float(np.hypot(points[:, 0], points[:, 1]).sum())
+
+
+def _place(
+    sizes: tuple[tuple[float, float], ...],
+    field: tuple[float, float],
+    exclusions: tuple[tuple[float, float, float, float], ...],
+    spacing: float,
+    grid: float,
+) -> tuple[tuple[float, float], ...] | None:
+    # centers of images on one reticle, None if they do not fit. Largest images
+    # first, each at the candidate nearest to the field center or packed from the
+    # bottom left corner and then shifted back onto the center, whichever fits
+    # with the shortest stage moves
+    candidates = [_candidates(size, field, exclusions, spacing, grid) for size in sizes]
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][0] * sizes[i][1])
+
+    def fits(points: np.ndarray) -> bool:
+        return all(
+            (candidates[i] == points[i]).all(axis=1).any() for i in range(len(sizes))
+        )
+
+    best = None
+    for key in [
+        lambda c: np.lexsort((c[:, 0], c[:, 1], np.hypot(c[:, 0], c[:, 1]))),
+        lambda c: np.lexsort((c[:, 0], c[:, 1])),
+    ]:
+        placed = [None] * len(sizes)
+        for i in order:
+            others = [(*placed[j], *sizes[j]) for j in range(len(sizes)) if placed[j]]
+            centers = candidates[i][_clear(candidates[i], sizes[i], others, spacing)]
+            if len(centers) == 0:
+                break
+            placed[i] = tuple(centers[key(centers)[0]])
+        else:
+            points = np.array(placed)
+            lower = (points - 0.5 * np.array(sizes)).min(axis=0)
+            upper = (points + 0.5 * np.array(sizes)).max(axis=0)
+            for center in [0.5 * (lower + upper), points.mean(axis=0)]:
+                # shifts keep the images on the grid and apart
+                shifted = points - np.round(center / grid) * grid
+                if _moves(shifted) < _moves(points) and fits(shifted):
+                    points = shifted
+
+            if best is None or _moves(points) < _moves(best):
+                best = points
+
+    if best is None:
+        return None
+    return tuple((float(x), float(y)) for x, y in best)
+
+
+def pack(
+    sizes: list[tuple[float, float]],
+    field: tuple[float, float] = RETICLE_FIELD,
+    exclusions: list[tuple[float, float, float, float]] = RETICLE_EXCLUSIONS,
+    spacing: float = IMAGE_SPACING,
+    grid: float = GRID,
+) -> list[tuple[int, float, float]]:
+    # (reticle index, x, y) of each image center, images in process order, the
+    # fewest reticles first, then the fewest reticle swaps between consecutive
+    # images, then the shortest stage moves from the field center
+    place = functools.cache(
+        lambda group: _place(
+            tuple(sizes[i] for i in group),
+            field,
+            tuple(map(tuple, exclusions)),
+            spacing,
+            grid,
+        )
+    )
+    for i in range(len(sizes)):
+        if place((i,)) is None:
+            raise ValueError(f"Image {i} of size {sizes[i]} does not fit on a reticle")
+
+    best = None
+
+    def cost(groups: list[tuple[int, ...]], assignment: list[int]) -> tuple:
+        swaps = sum(a != b for a, b in zip(assignment[:-1], assignment[1:]))
+        moves = sum(_moves(np.array(place(group))) for group in groups)
+        return (len(groups), swaps, moves)
+
+    # branch and bound over the assignment of images to reticles in process
+    # order, a new reticle always gets the next index
+    def search(i: int, groups: list[tuple[int, ...]], assignment: list[int]) -> None:
+        nonlocal best
+        swaps = sum(a != b for a, b in zip(assignment[:-1], assignment[1:]))
+        if best is not None and (len(groups), swaps) > best[0][:2]:
+            return
+
+        if i == len(sizes):
+            candidate = cost(groups, assignment)
+            if best is None or candidate < best[0]:
+                best = (candidate, list(groups), list(assignment))
+            return
+
+        # the reticle of the previous image first, it adds no swap
+        reticles = list(range(len(groups)))
+        if assignment:
+            reticles.remove(assignment[-1])
+            reticles.insert(0, assignment[-1])
+
+        for r in reticles:
+            group = tuple(sorted(groups[r] + (i,)))
+            if place(group) is None:
+                continue
+            search(i + 1, groups[:r] + [group] + groups[r + 1 :], assignment + [r])
+        search(i + 1, groups + [(i,)], assignment + [len(groups)])
+
+    search(0, [], [])
+
+    _, groups, assignment = best
+    result = []
+    for i, r in enumerate(assignment):
+        x, y = place(groups[r])[groups[r].index(i)]
+        result.append((r, x, y))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ASML reticle image packing")
+    parser.add_argument(
+        "--image",
+        action="append",
+        type=float,
+        nargs=2,
+        help="Image WIDTH HEIGHT in um in process order, can be repeated",
+        required=True,
+    )
+    parser.add_argument(
+        "--field",
+        action="store",
+        type=float,
+        nargs=2,
+        help="Exposure field WIDTH HEIGHT in um",
+        default=RETICLE_FIELD,
+    )
+    parser.add_argument(
+        "--exclusion",
+        action="append",
+        type=float,
+        nargs=4,
+        help="Excluded LEFT BOTTOM RIGHT TOP in um, can be repeated",
+        default=list(RETICLE_EXCLUSIONS),
+    )
+    parser.add_argument(
+        "--spacing",
+        action="store",
+        type=float,
+        help="Spacing between images in um",
+        default=IMAGE_SPACING,
+    )
+
+    args = parser.parse_args()
+
+    for i, (r, x, y) in enumerate(
+        pack(
+            [tuple(size) for size in args.image],
+            field=tuple(args.field),
+            exclusions=args.exclusion,
+            spacing=args.spacing,
+        )
+    ):
+        print(f"{i}: {r}, {x:.2f}, {y:.2f}")
@@ -26,6 +26,22 @@ class LAYERS(gf.technology.LayerMap):
     CAP_TRENCH_ETCH: gf.typings.Layer = (103, 0)
     CAP_BACKSIDE: gf.typings.Layer = (104, 0)
 
+    CHECK_UNRELEASED: gf.typings.Layer = (201, 0)
+    CHECK_FLOATING: gf.typings.Layer = (202, 0)
+
+    DRAFT_RELEASE: gf.typings.Layer = (211, 0)
+
+
+# process stack for 3D export of SOURCE layouts, body: (bottom z, thickness,
+# layers, removed layers) in um, None as layers is the whole die. Nominal values,
+# HANDLE leaves out the cavity trenches that build.py cuts around HANDLE_P*
+STACK = {
+    "HANDLE": (-402, 400, None, [LAYERS.HANDLE_REMOVE]),
+    "DEVICE": (0, 25, [LAYERS.DEVICE], [LAYERS.DEVICE_REMOVE]),
+    "POLY": (25, 0.5, [LAYERS.POLY], []),
+    "OXIDE": (25.5, 0.3, [LAYERS.OXIDE], []),
+    "NITRIDE": (25.8, 0.2, [LAYERS.NITRIDE], []),
+}
 
 PDK = gf.Pdk(
     name="mega_pc",
@@ -0,0 +1,228 @@
+import klayout.db as kdb
+import numpy as np
+
+import argparse
+import concurrent.futures
+import math
+import os
+
+from PIL import Image
+
+from output import fork_context, stem
+from pdk import LAYERS
+
+# RGB colors for composite images, cycled by layer order
+COLORS = [
+    (31, 119, 180),
+    (255, 127, 14),
+    (44, 160, 44),
+    (214, 39, 40),
+    (148, 103, 189),
+    (140, 86, 75),
+    (227, 119, 194),
+    (127, 127, 127),
+    (188, 189, 34),
+    (23, 190, 207),
+]
+COMPOSITE_ALPHA = 0.5
+
+# crossings are accumulated in chunks of this many edges to bound memory
+EDGE_CHUNK = 1 << 20
+
+# layout shared with forked workers
+_LAYOUT = None
+
+
+def scan_convert(edges: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+    # edges (n, 4) as x0, y0, x1, y1 in pixel units, pixel centers are sampled
+    # with the nonzero winding rule, so overlapping polygons need no merge
+    ny, nx = shape
+    winding = np.zeros(ny * (nx + 1), dtype=np.int32)
+
+    for chunk in range(0, len(edges), EDGE_CHUNK):
+        x0, y0, x1, y1 = edges[chunk : chunk + EDGE_CHUNK].T
+        keep = y0 != y1
+        x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+        direction = np.where(y1 > y0, 1, -1)
+
+        # rows with centers in [min(y0, y1), max(y0, y1))
+        r0 = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, ny).astype(np.int64)
+        r1 = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, ny).astype(np.int64)
+        counts = r1 - r0
+
+        edge = np.repeat(np.arange(len(counts)), counts)
+        rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows += r0[edge]
+
+        t = (rows + 0.5 - y0[edge]) / (y1[edge] - y0[edge])
+        x = x0[edge] + t * (x1[edge] - x0[edge])
+        cols = np.clip(np.ceil(x - 0.5), 0, nx).astype(np.int64)
+
+        winding += np.bincount(
+            rows * (nx + 1) + cols,
+            weights=direction[edge],
+            minlength=ny * (nx + 1),
+        ).astype(np.int32)
+
+    return np.cumsum(winding.reshape(ny, nx + 1), axis=1)[:, :nx] != 0
+
+
+def _edges(region: kdb.Region, origin: kdb.Point, pixel: float) -> np.ndarray:
+    # detail below half a pixel is invisible, drop it before leaving C++
+    region = region.smoothed(int(0.5 * pixel))
+    edges = np.array(
+        [(e.x1, e.y1, e.x2, e.y2) for e in region.edges().each()],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+    edges[:, [0, 2]] -= origin.x
+    edges[:, [1, 3]] -= origin.y
+    return edges / pixel
+
+
+def _render(
+    cell: kdb.Cell, layer: int, pixel: float, cache: dict
+) -> tuple[kdb.Point, np.ndarray] | None:
+    # raster of a cell in its own frame, cells placed by plain displacement
+    # are rendered once and stamped at each placement
+    if cell.cell_index() in cache:
+        return cache[cell.cell_index()]
+
+    box = cell.bbox(layer)
+    if box.empty():
+        cache[cell.cell_index()] = None
+        return None
+
+    origin = box.p1
+    shape = (math.ceil(box.height() / pixel), math.ceil(box.width() / pixel))
+
+    region = kdb.Region(cell.shapes(layer))
+    stamps = []
+    for inst in cell.each_inst():
+        child = cell.layout().cell(inst.cell_index)
+        for trans in inst.cell_inst.each_cplx_trans():
+            if trans.angle != 0 or trans.is_mirror() or trans.mag != 1:
+                region.insert(
+                    kdb.Region(child.begin_shapes_rec(layer)).transformed(trans)
+                )
+            else:
+                stamps.append((child, trans.disp))
+
+    image = scan_convert(_edges(region, origin, pixel), shape)
+
+    for child, disp in stamps:
+        result = _render(child, layer, pixel, cache)
+        if result is None:
+            continue
+        child_origin, child_image = result
+
+        x = round((child_origin.x + disp.x - origin.x) / pixel)
+        y = round((child_origin.y + disp.y - origin.y) / pixel)
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + child_image.shape[1], shape[1])
+        y1 = min(y + child_image.shape[0], shape[0])
+        if x0 < x1 and y0 < y1:
+            image[y0:y1, x0:x1] |= child_image[y0 - y : y1 - y, x0 - x : x1 - x]
+
+    cache[cell.cell_index()] = (origin, image)
+    return origin, image
+
+
+def _rasterize(layer: int, box: kdb.Box, pixel: float) -> np.ndarray:
+    top = _LAYOUT.top_cell()
+    shape = (math.ceil(box.height() / pixel), math.ceil(box.width() / pixel))
+    image = np.zeros(shape, dtype=bool)
+
+    result = _render(top, layer, pixel, {})
+    if result is not None:
+        origin, layer_image = result
+        x = round((origin.x - box.left) / pixel)
+        y = round((origin.y - box.bottom) / pixel)
+        h = min(layer_image.shape[0], shape[0] - y)
+        w = min(layer_image.shape[1], shape[1] - x)
+        image[y : y + h, x : x + w] = layer_image[:h, :w]
+
+    # image rows run top to bottom
+    return image[::-1]
+
+
+def _name(info: kdb.LayerInfo) -> str:
+    for layer in LAYERS:
+        if (layer.layer, layer.datatype) == (info.layer, info.datatype):
+            return str(layer)
+    return f"{info.layer}_{info.datatype}"
+
+
+def preview(
+    path: str,
+    resolution: int = 2000,
+    composite: bool = True,
+    workers: int | None = None,
+) -> list[str]:
+    global _LAYOUT
+
+    _LAYOUT = kdb.Layout()
+    _LAYOUT.read(path)
+    top = _LAYOUT.top_cell()
+
+    box = top.bbox()
+    pixel = max(box.width(), box.height()) / resolution
+    layers = [i for i in _LAYOUT.layer_indexes() if not top.bbox(i).empty()]
+    name = stem(path)
+
+    # one layer per worker, workers inherit the layout by forking
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=fork_context(),
+    ) as executor:
+        images = list(
+            executor.map(
+                _rasterize,
+                layers,
+                [box] * len(layers),
+                [pixel] * len(layers),
+            )
+        )
+
+    paths = []
+    for layer, image in zip(layers, images):
+        paths.append(f"{name}_{_name(_LAYOUT.get_info(layer))}.png")
+        Image.fromarray(np.where(image, 0, 255).astype(np.uint8)).save(paths[-1])
+
+    if composite and images:
+        rgb = np.full((*images[0].shape, 3), 255.0)
+        for i, image in enumerate(images):
+            color = np.array(COLORS[i % len(COLORS)], dtype=np.float64)
+            rgb[image] = (1 - COMPOSITE_ALPHA) * rgb[image] + COMPOSITE_ALPHA * color
+        paths.append(f"{name}_COMPOSITE.png")
+        Image.fromarray(rgb.astype(np.uint8)).save(paths[-1])
+
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Layer previews for MEGA-PC")
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="GDS/OASIS files to rasterize",
+    )
+    parser.add_argument(
+        "--resolution",
+        action="store",
+        type=int,
+        help="Image size in pixels along the longer side of the layout",
+        default=2000,
+    )
+    parser.add_argument(
+        "--no-composite",
+        action="store_true",
+        help="Don't write the multi-layer color composite",
+    )
+
+    args = parser.parse_args()
+
+    for file in args.files:
+        for path in preview(
+            file, resolution=args.resolution, composite=not args.no_composite
+        ):
+            print(path)
@@ -0,0 +1,501 @@
+import klayout.db as kdb
+import numpy as np
+
+import argparse
+import hashlib
+import os
+
+from output import stem
+from pdk import LAYERS
+
+# average number of edges per grid cell of a layer index
+EDGES_PER_CELL = 8
+MAX_GRID = 4096
+
+
+def _split(keys: np.ndarray, values: np.ndarray, n: int) -> list[np.ndarray]:
+    # values grouped by sorted keys in [0, n)
+    order = np.argsort(keys, kind="stable")
+    bounds = np.searchsorted(keys[order], np.arange(n + 1))
+    values = values[order]
+    return [values[bounds[i] : bounds[i + 1]] for i in range(n)]
+
+
+def _gather(offsets: np.ndarray, items: np.ndarray, cells: np.ndarray):
+    # (row, item) pairs of the CSR rows of cells, row indexes into cells
+    counts = offsets[cells + 1] - offsets[cells]
+    row = np.repeat(np.arange(len(cells)), counts)
+    start = np.repeat(offsets[cells] - np.cumsum(counts) + counts, counts)
+    return row, items[start + np.arange(counts.sum())]
+
+
+def _csr(cells: np.ndarray, items: np.ndarray, n: int):
+    order = np.argsort(cells, kind="stable")
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cells, minlength=n), out=offsets[1:])
+    return offsets, items[order]
+
+
+class _Layer:
+    # polygons of one layer as rings of vertices in um, with a uniform grid over
+    # the edges, each grid cell also lists the polygons covering its center so
+    # that point tests only look at the edges of one cell
+    def __init__(
+        self,
+        vertices: np.ndarray,
+        ring_offsets: np.ndarray,
+        polygon_rings: np.ndarray,
+        grid: np.ndarray | None = None,
+        cell_edges: tuple[np.ndarray, np.ndarray] | None = None,
+        cell_cover: tuple[np.ndarray, np.ndarray] | None = None,
+    ) -> None:
+        self.vertices = vertices
+        self.ring_offsets = ring_offsets
+        self.polygon_rings = polygon_rings
+        self.count = len(polygon_rings) - 1
+
+        # closing edge of each ring from its last to its first vertex
+        ring = np.repeat(np.arange(len(ring_offsets) - 1), np.diff(ring_offsets))
+        following = np.arange(len(vertices)) + 1
+        following[ring_offsets[1:] - 1] = ring_offsets[:-1]
+        self.edges = np.concatenate([vertices, vertices[following]], axis=1)
+        ring_polygon = np.repeat(np.arange(self.count), np.diff(polygon_rings))
+        self.edge_polygon = ring_polygon[ring]
+
+        self.boxes = np.zeros((self.count, 4))
+        if self.count:
+            starts = ring_offsets[polygon_rings[:-1]]
+            self.boxes[:, 0] = np.minimum.reduceat(vertices[:, 0], starts)
+            self.boxes[:, 1] = np.minimum.reduceat(vertices[:, 1], starts)
+            self.boxes[:, 2] = np.maximum.reduceat(vertices[:, 0], starts)
+            self.boxes[:, 3] = np.maximum.reduceat(vertices[:, 1], starts)
+
+        if grid is None:
+            self._grid()
+        else:
+            self.grid = grid
+            self.cell_edges = cell_edges
+            self.cell_cover = cell_cover
+
+    def _grid(self) -> None:
+        if self.count:
+            left, bottom = self.boxes[:, :2].min(axis=0)
+            right, top = self.boxes[:, 2:].max(axis=0)
+        else:
+            left, bottom, right, top = 0, 0, 1, 1
+        n = int(np.clip(np.sqrt(len(self.edges) / EDGES_PER_CELL), 1, MAX_GRID))
+        size = max(right - left, top - bottom, 1e-3) / n
+        nx = max(int(np.ceil((right - left) / size)), 1)
+        ny = max(int(np.ceil((top - bottom) / size)), 1)
+        self.grid = np.array([left, bottom, size, nx, ny])
+
+        # edges register in every cell their bbox touches
+        x0, y0, x1, y1 = self.edges.T
+        c0, r0 = self._cell(np.minimum(x0, x1), np.minimum(y0, y1))
+        c1, r1 = self._cell(np.maximum(x0, x1), np.maximum(y0, y1))
+        w, h = c1 - c0 + 1, r1 - r0 + 1
+        edge = np.repeat(np.arange(len(self.edges)), w * h)
+        k = np.arange(edge.size) - np.repeat(np.cumsum(w * h) - w * h, w * h)
+        cells = (r0[edge] + k // w[edge]) * nx + c0[edge] + k % w[edge]
+        self.cell_edges = _csr(cells, edge, nx * ny)
+
+        # even-odd crossings of each row of cell centers, paired per polygon
+        centers_y = bottom + (np.arange(ny) + 0.5) * size
+        lo = np.ceil((np.minimum(y0, y1) - bottom) / size - 0.5).astype(np.int64)
+        hi = np.ceil((np.maximum(y0, y1) - bottom) / size - 0.5).astype(np.int64)
+        lo, hi = np.clip(lo, 0, ny), np.clip(hi, 0, ny)
+        spans = hi - lo
+        edge = np.repeat(np.arange(len(self.edges)), spans)
+        row = (
+            lo[edge]
+            + np.arange(spans.sum())
+            - np.repeat(np.cumsum(spans) - spans, spans)
+        )
+        t = (centers_y[row] - y0[edge]) / (y1[edge] - y0[edge])
+        x = x0[edge] + t * (x1[edge] - x0[edge])
+        polygon = self.edge_polygon[edge]
+
+        order = np.lexsort((x, polygon, row))
+        row, polygon, x = row[order], polygon[order], x[order]
+        start, end = x[0::2], x[1::2]
+        row, polygon = row[0::2], polygon[0::2]
+
+        # centers with an odd number of crossings strictly left of them
+        c0 = np.floor((start - left) / size - 0.5).astype(np.int64) + 1
+        c1 = np.floor((end - left) / size - 0.5).astype(np.int64) + 1
+        c0, c1 = np.clip(c0, 0, nx), np.clip(c1, 0, nx)
+        spans = c1 - c0
+        pair = np.repeat(np.arange(len(spans)), spans)
+        col = (
+            c0[pair]
+            + np.arange(spans.sum())
+            - np.repeat(np.cumsum(spans) - spans, spans)
+        )
+        self.cell_cover = _csr(row[pair] * nx + col, polygon[pair], nx * ny)
+
+    def _cell(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        left, bottom, size, nx, ny = self.grid
+        col = np.clip(np.floor((x - left) / size), 0, nx - 1).astype(np.int64)
+        row = np.clip(np.floor((y - bottom) / size), 0, ny - 1).astype(np.int64)
+        return col, row
+
+    def _inside(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # (point, polygon) pairs with the point inside the polygon
+        left, bottom, size, nx, ny = self.grid
+        nx = int(nx)
+        if self.count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        col, row = self._cell(points[:, 0], points[:, 1])
+        cells = row * nx + col
+        cx = left + (col + 0.5) * size
+        cy = bottom + (row + 0.5) * size
+
+        # parity of the path from the cell center along x, then along y
+        q, edge = _gather(*self.cell_edges, cells)
+        x0, y0, x1, y1 = self.edges[edge].T
+        px, py = points[q, 0], points[q, 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (cy[q] - y0) / (y1 - y0)
+            xh = x0 + t * (x1 - x0)
+            u = (px - x0) / (x1 - x0)
+            yv = y0 + u * (y1 - y0)
+        horizontal = ((y0 > cy[q]) != (y1 > cy[q])) & (
+            (xh >= np.minimum(cx[q], px)) & (xh < np.maximum(cx[q], px))
+        )
+        vertical = ((x0 > px) != (x1 > px)) & (
+            (yv >= np.minimum(cy[q], py)) & (yv < np.maximum(cy[q], py))
+        )
+        crossing = horizontal ^ vertical
+
+        keys, counts = np.unique(
+            q[crossing] * self.count + self.edge_polygon[edge[crossing]],
+            return_counts=True,
+        )
+        q, polygon = _gather(*self.cell_cover, cells)
+        keys = np.setxor1d(keys[counts % 2 == 1], q * self.count + polygon)
+
+        # points outside of the grid are outside of every polygon
+        outside = (
+            (points[:, 0] < left)
+            | (points[:, 0] > left + nx * size)
+            | (points[:, 1] < bottom)
+            | (points[:, 1] > bottom + ny * size)
+        )
+        keys = keys[~outside[keys // self.count]]
+        return keys // self.count, keys % self.count
+
+    def _near(
+        self, points: np.ndarray, distance: float
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (point, polygon, distance) of the polygons within distance of points
+        left, bottom, size, nx, ny = self.grid
+        nx = int(nx)
+        if self.count == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+        c0, r0 = self._cell(points[:, 0] - distance, points[:, 1] - distance)
+        c1, r1 = self._cell(points[:, 0] + distance, points[:, 1] + distance)
+        w, h = c1 - c0 + 1, r1 - r0 + 1
+        q = np.repeat(np.arange(len(points)), w * h)
+        k = np.arange(q.size) - np.repeat(np.cumsum(w * h) - w * h, w * h)
+        cells = (r0[q] + k // w[q]) * nx + c0[q] + k % w[q]
+
+        row, edge = _gather(*self.cell_edges, cells)
+        q = q[row]
+        x0, y0, x1, y1 = self.edges[edge].T
+        dx, dy = x1 - x0, y1 - y0
+        length = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((points[q, 0] - x0) * dx + (points[q, 1] - y0) * dy) / length
+        t = np.clip(np.nan_to_num(t), 0, 1)
+        d = np.hypot(x0 + t * dx - points[q, 0], y0 + t * dy - points[q, 1])
+
+        keep = d <= distance
+        q_inside, polygon_inside = self._inside(points)
+        q = np.concatenate([q[keep], q_inside])
+        polygon = np.concatenate([self.edge_polygon[edge[keep]], polygon_inside])
+        d = np.concatenate([d[keep], np.zeros(len(q_inside))])
+
+        # closest edge of each (point, polygon)
+        keys = q * self.count + polygon
+        order = np.lexsort((d, keys))
+        keys, d = keys[order], d[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        return keys[first] // self.count, keys[first] % self.count, d[first]
+
+
+class Index:
+    # per layer spatial index of a layout, all coordinates in um
+    def __init__(self, layers: dict[str, _Layer], dbu: float, digest: str = "") -> None:
+        self.layers = layers
+        self.dbu = dbu
+        self.digest = digest
+
+    @classmethod
+    def build(
+        cls, layout: kdb.Layout, cell: kdb.Cell | None = None, digest: str = ""
+    ) -> "Index":
+        # flattens the cell (default the top cell), polygons are not merged
+        cell = cell or layout.top_cell()
+        layers = {}
+        for index in layout.layer_indexes():
+            if cell.bbox(index).empty():
+                continue
+
+            vertices = []
+            ring_sizes = []
+            polygon_rings = [0]
+            for polygon in kdb.Region(cell.begin_shapes_rec(index)).each():
+                polygon = polygon.to_dtype(layout.dbu)
+                rings = [list(polygon.each_point_hull())]
+                rings += [
+                    list(polygon.each_point_hole(h)) for h in range(polygon.holes())
+                ]
+                for ring in rings:
+                    vertices += [(p.x, p.y) for p in ring]
+                    ring_sizes.append(len(ring))
+                polygon_rings.append(polygon_rings[-1] + len(rings))
+
+            layers[_name(layout.get_info(index))] = _Layer(
+                np.array(vertices, dtype=np.float64).reshape(-1, 2),
+                np.concatenate([[0], np.cumsum(ring_sizes)]).astype(np.int64),
+                np.array(polygon_rings, dtype=np.int64),
+            )
+
+        return cls(layers, layout.dbu, digest)
+
+    @classmethod
+    def open(cls, path: str) -> "Index":
+        # index of a GDS/OASIS file, reloaded from {stem}_INDEX.npz next to it
+        # while the file is unchanged
+        digest = _digest(path)
+        cache = _index_path(path)
+        if os.path.exists(cache):
+            index = cls.load(cache)
+            if index.digest == digest:
+                return index
+
+        layout = kdb.Layout()
+        layout.read(path)
+        index = cls.build(layout, digest=digest)
+        index.save(cache)
+        return index
+
+    def save(self, path: str) -> None:
+        arrays = {"dbu": np.array(self.dbu), "digest": np.array(self.digest)}
+        for name, layer in self.layers.items():
+            arrays[f"{name}/vertices"] = layer.vertices
+            arrays[f"{name}/ring_offsets"] = layer.ring_offsets
+            arrays[f"{name}/polygon_rings"] = layer.polygon_rings
+            arrays[f"{name}/grid"] = layer.grid
+            arrays[f"{name}/cell_edges"] = np.concatenate(layer.cell_edges)
+            arrays[f"{name}/cell_edges_size"] = np.array(len(layer.cell_edges[0]))
+            arrays[f"{name}/cell_cover"] = np.concatenate(layer.cell_cover)
+            arrays[f"{name}/cell_cover_size"] = np.array(len(layer.cell_cover[0]))
+
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "Index":
+        with np.load(path) as data:
+            names = {key.split("/")[0] for key in data.files if "/" in key}
+            layers = {}
+            for name in names:
+
+                def csr(key: str) -> tuple[np.ndarray, np.ndarray]:
+                    n = int(data[f"{name}/{key}_size"])
+                    return data[f"{name}/{key}"][:n], data[f"{name}/{key}"][n:]
+
+                layers[name] = _Layer(
+                    data[f"{name}/vertices"],
+                    data[f"{name}/ring_offsets"],
+                    data[f"{name}/polygon_rings"],
+                    data[f"{name}/grid"],
+                    csr("cell_edges"),
+                    csr("cell_cover"),
+                )
+            return cls(layers, float(data["dbu"]), str(data["digest"]))
+
+    def polygon(self, layer: str, i: int) -> kdb.DPolygon:
+        layer = self.layers[layer]
+        rings = [
+            [
+                kdb.DPoint(*p)
+                for p in layer.vertices[
+                    layer.ring_offsets[r] : layer.ring_offsets[r + 1]
+                ]
+            ]
+            for r in range(layer.polygon_rings[i], layer.polygon_rings[i + 1])
+        ]
+        polygon = kdb.DPolygon(rings[0], True)
+        for ring in rings[1:]:
+            polygon.insert_hole(ring, True)
+        return polygon
+
+    def contains(self, layer: str, points: np.ndarray) -> list[np.ndarray]:
+        # polygons containing each point
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        q, polygon = self.layers[layer]._inside(points)
+        return _split(q, polygon, len(points))
+
+    def covers(self, points: np.ndarray) -> dict[str, np.ndarray]:
+        # layers covering each point
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        result = {}
+        for name, layer in self.layers.items():
+            q, _ = layer._inside(points)
+            result[name] = np.zeros(len(points), dtype=bool)
+            result[name][q] = True
+        return result
+
+    def within(
+        self, layer: str, points: np.ndarray, distance: float
+    ) -> list[np.ndarray]:
+        # polygons within distance of each point, sorted by distance
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        q, polygon, d = self.layers[layer]._near(points, distance)
+        order = np.lexsort((d, q))
+        return _split(q[order], polygon[order], len(points))
+
+    def nearest(self, layer: str, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # closest polygon to each point and its distance, 0 inside a polygon
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        index = self.layers[layer]
+        result = np.full(len(points), -1, dtype=np.int64)
+        distance = np.full(len(points), np.inf)
+        if index.count == 0:
+            return result, distance
+
+        # grow the search box until every point has a candidate
+        pending = np.arange(len(points))
+        radius = index.grid[2]
+        while len(pending):
+            q, polygon, d = index._near(points[pending], radius)
+            order = np.lexsort((d, q))
+            q, polygon, d = q[order], polygon[order], d[order]
+            first = np.ones(len(q), dtype=bool)
+            first[1:] = q[1:] != q[:-1]
+            result[pending[q[first]]] = polygon[first]
+            distance[pending[q[first]]] = d[first]
+            pending = pending[~np.isin(np.arange(len(pending)), q)]
+            radius *= 2
+
+        return result, distance
+
+    def box(
+        self, layer: str, box: tuple[float, float, float, float], inside: bool = False
+    ) -> np.ndarray:
+        # polygons overlapping (or entirely inside) LEFT BOTTOM RIGHT TOP
+        index = self.layers[layer]
+        left, bottom, right, top = box
+        boxes = index.boxes
+        enclosed = (
+            (boxes[:, 0] >= left)
+            & (boxes[:, 1] >= bottom)
+            & (boxes[:, 2] <= right)
+            & (boxes[:, 3] <= top)
+        )
+        if inside:
+            return np.nonzero(enclosed)[0]
+
+        candidates = np.nonzero(
+            (boxes[:, 0] <= right)
+            & (boxes[:, 2] >= left)
+            & (boxes[:, 1] <= top)
+            & (boxes[:, 3] >= bottom)
+            & ~enclosed
+        )[0]
+        query = kdb.DBox(left, bottom, right, top)
+        touching = [i for i in candidates if self.polygon(layer, i).touches(query)]
+        return np.sort(np.concatenate([np.nonzero(enclosed)[0], touching])).astype(
+            np.int64
+        )
+
+
+def _name(info: kdb.LayerInfo) -> str:
+    for layer in LAYERS:
+        if (layer.layer, layer.datatype) == (info.layer, info.datatype):
+            return str(layer)
+    return f"{info.layer}_{info.datatype}"
+
+
+def _digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _index_path(path: str) -> str:
+    return f"{stem(path)}_INDEX.npz"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spatial queries on MEGA-PC layouts")
+    parser.add_argument(
+        "file",
+        help="GDS/OASIS file to query, the index is cached next to it",
+    )
+    parser.add_argument(
+        "--layer",
+        action="store",
+        type=str,
+        help="Layer name for --box, --within and --nearest",
+        default=None,
+    )
+    parser.add_argument(
+        "--point",
+        action="append",
+        type=float,
+        nargs=2,
+        help="Query point X Y in um, can be repeated",
+        default=[],
+    )
+    parser.add_argument(
+        "--box",
+        action="store",
+        type=float,
+        nargs=4,
+        help="List polygons of --layer overlapping LEFT BOTTOM RIGHT TOP",
+        default=None,
+    )
+    parser.add_argument(
+        "--inside",
+        action="store_true",
+        help="Only list polygons entirely inside --box",
+    )
+    parser.add_argument(
+        "--within",
+        action="store",
+        type=float,
+        help="List polygons of --layer within this distance of each point",
+        default=None,
+    )
+    parser.add_argument(
+        "--nearest",
+        action="store_true",
+        help="Closest polygon of --layer to each point",
+    )
+
+    args = parser.parse_args()
+
+    index = Index.open(args.file)
+    points = np.array(args.point, dtype=np.float64).reshape(-1, 2)
+
+    if args.box is not None:
+        for i in index.box(args.layer, args.box, inside=args.inside):
+            print(f"{args.layer} {i}: {index.polygon(args.layer, i)}")
+    elif args.within is not None:
+        for point, found in zip(points, index.within(args.layer, points, args.within)):
+            print(f"{point[0]:.3f}, {point[1]:.3f}: {', '.join(map(str, found))}")
+    elif args.nearest:
+        for point, i, d in zip(points, *index.nearest(args.layer, points)):
+            print(f"{point[0]:.3f}, {point[1]:.3f}: {i} at {d:.3f}")
+    else:
+        covers = index.covers(points)
+        for i, point in enumerate(points):
+            layers = [name for name, covered in covers.items() if covered[i]]
+            print(f"{point[0]:.3f}, {point[1]:.3f}: {', '.join(layers)}")
@@ -0,0 +1,75 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import math
+import os
+
+# tiles are eroded in parallel, each tile sees its neighborhood up to the border
+TILE_SIZE = 500
+
+
+def _erode(region: kdb.Region, distance: float, dbu: float) -> kdb.Region:
+    # tiled, multi-threaded equivalent of region.sized(-distance)
+    output = kdb.Region()
+
+    tp = kdb.TilingProcessor()
+    tp.dbu = dbu
+    tp.tile_size(TILE_SIZE, TILE_SIZE)
+    tp.tile_border(2 * distance, 2 * distance)
+    tp.threads = os.cpu_count()
+    tp.input("region", region)
+    tp.output("output", output)
+    tp.var("d", round(distance / dbu))
+    tp.queue("_output(output, region.sized(-d) & _tile, false)")
+    tp.execute("Release etch")
+
+    return output.merged()
+
+
+def simulate(
+    component: gf.Component,
+    device_layer: gf.typings.Layer,
+    remove_layer: gf.typings.Layer,
+    undercut: float,
+    hole_radius: float,
+    hole_distance: float,
+    bias: float = 0,
+    merged: bool = True,
+) -> tuple[kdb.Region, kdb.Region]:
+    # isotropic oxide undercut by a fixed distance from every DEVICE edge,
+    # returns (oxide left inside release hole fields, fully released islands)
+    dbu = component.kcl.dbu
+    device = kdb.Region(component.kdb_cell.begin_shapes_rec(gf.get_layer(device_layer)))
+    remove = kdb.Region(component.kdb_cell.begin_shapes_rec(gf.get_layer(remove_layer)))
+    if bias != 0:
+        # undo the process compensation, the etch opens the drawn geometry
+        remove.size(round(-bias / dbu))
+
+    if merged:
+        # DEVICE_REMOVE is the complement of the silicon
+        silicon = kdb.Region(component.kdb_cell.bbox()) - remove
+    else:
+        silicon = device - remove
+
+    remainder = _erode(silicon, undercut, dbu)
+
+    hole_area = 1.1 * math.pi * (hole_radius / dbu) ** 2
+    holes = remove.with_area(0, round(hole_area), False)
+    field = holes.sized(round((hole_radius + hole_distance) / dbu)) & silicon
+
+    unreleased = remainder & field
+    floating = silicon.not_interacting(remainder)
+
+    return unreleased, floating
+
+
+def markers(
+    unreleased: kdb.Region,
+    floating: kdb.Region,
+    unreleased_layer: gf.typings.Layer,
+    floating_layer: gf.typings.Layer,
+) -> gf.Component:
+    c = gf.Component()
+    c.kdb_cell.shapes(gf.get_layer(unreleased_layer)).insert(unreleased)
+    c.kdb_cell.shapes(gf.get_layer(floating_layer)).insert(floating)
+    return c
@@ -0,0 +1,293 @@
+import gdsfactory as gf
+import gfebuild as gb
+import klayout.db as kdb
+
+import concurrent.futures
+import os
+import tempfile
+import warnings
+
+from output import fork_context
+from packing import pack
+from pdk import LAYERS
+
+# component shared with forked workers
+_COMPONENT = None
+
+# name of the stub cell holding the outline of an image, followed by its layer
+OUTLINE_PREFIX = "outline_"
+
+
+def _image_box(component: gf.Component, image_size: tuple[float, float]) -> kdb.Box:
+    # image field centered on the component
+    center = component.dbbox().center()
+    w, h = image_size
+    return kdb.DBox(
+        center.x - 0.5 * w, center.y - 0.5 * h, center.x + 0.5 * w, center.y + 0.5 * h
+    ).to_itype(component.kcl.dbu)
+
+
+def _extract(layer: int, box: kdb.Box, directory: str) -> str:
+    region = kdb.Region(
+        _COMPONENT.kdb_cell.begin_shapes_rec_overlapping(layer, box)
+    ) & kdb.Region(box)
+
+    layout = kdb.Layout()
+    layout.dbu = _COMPONENT.kcl.dbu
+    layout.create_cell("image").shapes(layout.layer(0, 0)).insert(region.merged())
+
+    path = os.path.join(directory, f"{layer}.oas")
+    layout.write(path)
+    return path
+
+
+def images(
+    component: gf.Component,
+    layers: list[gf.typings.Layer],
+    image_size: tuple[float, float],
+    workers: int | None = None,
+) -> dict[int, kdb.Region]:
+    # each image layer clipped to the image field by layer index, one forked
+    # worker per layer
+    global _COMPONENT
+    _COMPONENT = component
+
+    box = _image_box(component, image_size)
+    indexes = [gf.get_layer(layer) for layer in layers]
+    with tempfile.TemporaryDirectory() as directory:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=fork_context(),
+        ) as executor:
+            paths = list(
+                executor.map(
+                    _extract,
+                    indexes,
+                    [box] * len(indexes),
+                    [directory] * len(indexes),
+                )
+            )
+
+        regions = {}
+        for layer, path in zip(indexes, paths):
+            layout = kdb.Layout()
+            layout.read(path)
+            # a region from an iterator refers to the layout, copy the shapes
+            regions[layer] = kdb.Region()
+            regions[layer].insert(
+                layout.top_cell().begin_shapes_rec(layout.layer(0, 0))
+            )
+
+    return regions
+
+
+def _tagged(
+    reticle: gf.Component, key: gf.typings.Layer
+) -> list[tuple[int, kdb.ICplxTrans, kdb.Shape]]:
+    # every shape of the outline cells of an image on the reticle, with its
+    # layer and placement
+    name = f"{OUTLINE_PREFIX}{LAYERS(key)}"
+    found = []
+    for index in reticle.kcl.layer_indexes():
+        it = reticle.kdb_cell.begin_shapes_rec(index)
+        it.unselect_all_cells()
+        it.select_cells(name)
+        it.select_cells(f"{name}$*")
+        while not it.at_end():
+            found.append((index, it.trans(), it.shape()))
+            it.next()
+    return found
+
+
+def _nearest(
+    reticle: gf.Component, box: kdb.Box, position: tuple[float, float]
+) -> tuple[int, kdb.Shape]:
+    # image-sized shape of a flat reticle closest to the placement, with its
+    # layer
+    target = kdb.DPoint(*position).to_itype(reticle.kcl.dbu)
+    found = None
+    for index in reticle.kcl.layer_indexes():
+        for shape in reticle.kdb_cell.shapes(index).each():
+            bbox = shape.bbox()
+            if (bbox.width(), bbox.height()) != (box.width(), box.height()):
+                continue
+            distance = bbox.center().distance(target)
+            if found is None or distance < found[0]:
+                found = (distance, index, shape)
+
+    if found is None:
+        raise RuntimeError(f"No image outline found near {position} on the reticle")
+    return found[1], found[2]
+
+
+def _locate(
+    reticles: list[gf.Component],
+    placements: dict,
+    box: kdb.Box,
+    stub: gf.Component,
+) -> dict[gf.typings.Layer, tuple[int, kdb.Point]]:
+    # layer index and center of each image outline gb laid out, the outlines
+    # are removed. The outline cells are used when gb kept one per image and
+    # only moved it, otherwise the reticles are flattened and the image-sized
+    # shape nearest to the gb placement of each image is used
+    found = {key: _tagged(reticles[value[0]], key) for key, value in placements.items()}
+    tagged = all(
+        len(shapes) == 1
+        and not shapes[0][1].is_mag()
+        and not shapes[0][1].is_mirror()
+        and shapes[0][1].angle == 0
+        for shapes in found.values()
+    )
+
+    layout = stub.kcl.layout
+    cells = {stub.kdb_cell.cell_index()}
+    cells.update(stub.kdb_cell.each_child_cell())
+    outlines = {}
+    if tagged:
+        for key, [(index, trans, shape)] in found.items():
+            outlines[key] = (index, shape.bbox().transformed(trans).center())
+            cells.add(shape.cell.cell_index())
+    else:
+        warnings.warn(
+            "gb.asml300.reticle did not keep the image outline cells, "
+            "falling back to the flattened reticles"
+        )
+        for reticle in reticles:
+            reticle.flatten()
+        for key, value in placements.items():
+            index, shape = _nearest(reticles[value[0]], box, value[1:])
+            outlines[key] = (index, shape.bbox().center())
+            shape.delete()
+
+    for cell in cells:
+        if layout.is_valid_cell_index(cell):
+            stub.kcl[cell].delete()
+    return outlines
+
+
+def _stub(box: kdb.Box, layers: list[gf.typings.Layer]) -> gf.Component:
+    # one outline cell per image, so the outlines cannot be confused with frame
+    # features of the same size
+    stub = gf.Component()
+    for layer in layers:
+        outline = gf.Component(name=f"{OUTLINE_PREFIX}{LAYERS(layer)}")
+        outline.kdb_cell.shapes(gf.get_layer(layer)).insert(box)
+        stub.kdb_cell.insert(
+            kdb.CellInstArray(outline.kdb_cell.cell_index(), kdb.Trans())
+        )
+    return stub
+
+
+def _exclusions(reticle: gf.Component) -> list[tuple[float, float, float, float]]:
+    # LEFT BOTTOM RIGHT TOP (um) of the convex parts of every shape on a reticle
+    # without images, the frame features for packing.pack
+    frame = kdb.Region()
+    for layer in reticle.kcl.layer_indexes():
+        frame.insert(reticle.kdb_cell.begin_shapes_rec(layer))
+
+    dbu = reticle.kcl.dbu
+    return [
+        (box.left * dbu, box.bottom * dbu, box.right * dbu, box.top * dbu)
+        for box in (
+            polygon.bbox()
+            for polygon in frame.merged().decompose_convex_to_region().each()
+        )
+    ]
+
+
+def assemble(
+    component: gf.Component,
+    image_size: tuple[float, float],
+    image_layers: list[gf.typings.Layer],
+    packed: bool = False,
+    workers: int | None = None,
+    **kwargs,
+) -> tuple[list[gf.Component], dict]:
+    # gb.asml300.reticle lays out a stub holding only the outline cell of each
+    # image, the images are extracted in parallel and referenced where their
+    # outline landed, see _locate. Packed, the frame features of that layout
+    # are the exclusions of packing.pack, gb lays out each packed reticle on its
+    # own and the images go to the packed centers. Returns the reticles and
+    # {layer: (reticle index, x, y)} of the image centers
+    box = _image_box(component, image_size)
+    regions = images(component, image_layers, image_size, workers)
+
+    stub = _stub(box, image_layers)
+    reticles, placements = gb.asml300.reticle(
+        component=stub,
+        image_size=image_size,
+        image_layers=image_layers,
+        **kwargs,
+    )
+    outlines = _locate(reticles, placements, box, stub)
+    frames = {key: reticles[value[0]] for key, value in placements.items()}
+
+    if packed:
+        exclusions = _exclusions(reticles[0])
+        for reticle in reticles:
+            reticle.delete()
+
+        placements = dict(
+            zip(
+                image_layers,
+                pack([image_size] * len(image_layers), exclusions=exclusions),
+            )
+        )
+        count = max(value[0] for value in placements.values()) + 1
+        reticles = []
+        frames = {}
+        outlines = {}
+        for i in range(count):
+            layers = [key for key in image_layers if placements[key][0] == i]
+            options = dict(kwargs)
+            if count > 1 and "id" in options:
+                options["id"] = f"{options['id']}-{i}"
+
+            stub = _stub(box, layers)
+            frame, laid_out = gb.asml300.reticle(
+                component=stub,
+                image_size=image_size,
+                image_layers=layers,
+                **options,
+            )
+            if len(frame) != 1:
+                raise RuntimeError(
+                    f"Reticle {i} images were split over {len(frame)} reticles"
+                )
+            outlines.update(_locate(frame, laid_out, box, stub))
+            reticles.append(frame[0])
+            for key in layers:
+                frames[key] = frame[0]
+
+    displacements = {}
+    for key, reticle in frames.items():
+        index, center = outlines[key]
+        if packed:
+            center = kdb.DPoint(*placements[key][1:]).to_itype(component.kcl.dbu)
+        displacements[key] = (index, center - box.center())
+
+    if packed:
+        # the exclusions come from another gb layout, so packed images are checked
+        # against the frame they end up on
+        for key, reticle in frames.items():
+            frame = kdb.Region()
+            for layer in reticle.kcl.layer_indexes():
+                frame.insert(reticle.kdb_cell.begin_shapes_rec(layer))
+            moved = box.moved(displacements[key][1])
+            if not frame.interacting(kdb.Region(moved)).is_empty():
+                raise RuntimeError(
+                    f"Packed image {LAYERS(key)} at {placements[key][1:]} "
+                    "overlaps the reticle frame"
+                )
+
+    for key, reticle in frames.items():
+        index, displacement = displacements[key]
+
+        # images are shared by the reticle and its mirrored copy
+        image = gf.Component(name=f"image_{LAYERS(key)}")
+        image.kdb_cell.shapes(index).insert(regions[gf.get_layer(key)])
+        reticle.kdb_cell.insert(
+            kdb.CellInstArray(image.kdb_cell.cell_index(), kdb.Trans(displacement))
+        )
+
+    return reticles, placements
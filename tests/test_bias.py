@@ -0,0 +1,26 @@
+import klayout.db as kdb
+
+from bias import bias
+
+DBU = 0.001
+
+
+def _contains(region: kdb.Region, x: float, y: float) -> bool:
+    probe = kdb.Region(kdb.DBox(x, y, x, y).enlarged(DBU).to_itype(DBU))
+    return (probe - region).is_empty()
+
+
+def test_edge_split_between_classes():
+    # L-shaped opening, the bottom edge faces 5 um under the foot and 100 um
+    # under the column
+    opening = kdb.Region()
+    opening.insert(kdb.DBox(0, 0, 20, 100).to_itype(DBU))
+    opening.insert(kdb.DBox(20, 0, 50, 5).to_itype(DBU))
+
+    result = bias(opening, [(10, 2), (None, 0.5)], DBU)
+
+    # the foot takes the narrow bias
+    assert _contains(result, 40, -1.5)
+    # the column keeps the wide bias on the same edge
+    assert _contains(result, 5, -0.3)
+    assert not _contains(result, 5, -1.5)
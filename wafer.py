@@ -0,0 +1,245 @@
+import gdsfactory as gf
+import klayout.db as kdb
+import numpy as np
+
+import argparse
+import json
+
+from pdk import LAYERS, PDK
+
+WAFER_DIAMETER = 150000
+WAFER_ALIGNMENT_MARKS = [
+    (-40000, 2000),
+    (40000, 2000),
+    (-40000, -2000),
+    (40000, -2000),
+    (-8000, 48000),
+    (8000, 48000),
+]
+
+# side of the square kept clear of chips around each alignment mark (um)
+MARK_KEEPOUT = 2000
+
+# rim of the wafer kept clear of chips (um)
+EDGE_EXCLUSION = 3000
+
+
+def load(path: str) -> tuple[dict[str, str], dict[tuple[int, int], str]]:
+    # JSON object with "designs", design name to layout file, and "sites",
+    # "COLUMN,ROW" of the site to the design name. Site 0,0 is centered on the
+    # wafer, the others are one step apart
+    with open(path) as f:
+        data = json.load(f)
+
+    site_map = {}
+    for key, design in data["sites"].items():
+        column, row = (int(value) for value in key.split(","))
+        site_map[(column, row)] = design
+    return data.get("designs", {}), site_map
+
+
+def _boxes(sites: np.ndarray, step: tuple[float, float]) -> np.ndarray:
+    # (n, 4) LEFT BOTTOM RIGHT TOP of each site
+    centers = sites * np.array(step)
+    half = 0.5 * np.array(step)
+    return np.hstack([centers - half, centers + half])
+
+
+def _clear(
+    boxes: np.ndarray,
+    radius: float,
+    marks: list[tuple[float, float]],
+    keepout: float,
+    edge: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    # sites within the exposed wafer, sites clear of every mark keep-out
+    corners = np.maximum(np.abs(boxes[:, :2]), np.abs(boxes[:, 2:]))
+    inside = np.hypot(corners[:, 0], corners[:, 1]) <= radius - edge
+
+    clear = np.ones(len(boxes), dtype=bool)
+    for x, y in marks:
+        clear &= (
+            (boxes[:, 2] <= x - 0.5 * keepout)
+            | (boxes[:, 0] >= x + 0.5 * keepout)
+            | (boxes[:, 3] <= y - 0.5 * keepout)
+            | (boxes[:, 1] >= y + 0.5 * keepout)
+        )
+    return inside, clear
+
+
+def sites(
+    step: tuple[float, float],
+    radius: float = 0.5 * WAFER_DIAMETER,
+    marks: list[tuple[float, float]] = WAFER_ALIGNMENT_MARKS,
+    keepout: float = MARK_KEEPOUT,
+    edge: float = EDGE_EXCLUSION,
+) -> list[tuple[int, int]]:
+    # every usable site (column, row), by row then column
+    n = int(radius // min(step)) + 1
+    columns, rows = np.meshgrid(np.arange(-n, n + 1), np.arange(-n, n + 1))
+    grid = np.stack([columns.ravel(), rows.ravel()], axis=-1)
+    inside, clear = _clear(_boxes(grid, step), radius, marks, keepout, edge)
+    return [(int(i), int(j)) for i, j in grid[inside & clear]]
+
+
+def check(
+    site_map: dict[tuple[int, int], str],
+    sizes: dict[str, tuple[float, float]],
+    step: tuple[float, float],
+    radius: float = 0.5 * WAFER_DIAMETER,
+    marks: list[tuple[float, float]] = WAFER_ALIGNMENT_MARKS,
+    keepout: float = MARK_KEEPOUT,
+    edge: float = EDGE_EXCLUSION,
+) -> list[str]:
+    # unknown designs, designs larger than a site, sites off the exposed wafer
+    # or on a mark keep-out
+    errors = []
+    for design, (w, h) in sorted(sizes.items()):
+        if w > step[0] or h > step[1]:
+            errors.append(
+                f"{design}: {w:.2f} x {h:.2f} does not fit the "
+                f"{step[0]:.2f} x {step[1]:.2f} step"
+            )
+
+    keys = sorted(site_map)
+    for key in keys:
+        if site_map[key] not in sizes:
+            errors.append(f"site {key[0]},{key[1]}: unknown design {site_map[key]}")
+
+    if keys:
+        inside, clear = _clear(
+            _boxes(np.array(keys), step), radius, marks, keepout, edge
+        )
+        for key, i, c in zip(keys, inside, clear):
+            if not i:
+                errors.append(f"site {key[0]},{key[1]}: outside of the wafer edge")
+            if not c:
+                errors.append(f"site {key[0]},{key[1]}: on an alignment mark keep-out")
+
+    return errors
+
+
+def compose(
+    designs: dict[str, gf.Component],
+    site_map: dict[tuple[int, int], str],
+    step: tuple[float, float],
+    layers: list[gf.typings.Layer] | None = None,
+    name: str = "wafer",
+    radius: float = 0.5 * WAFER_DIAMETER,
+    marks: list[tuple[float, float]] = WAFER_ALIGNMENT_MARKS,
+    keepout: float = MARK_KEEPOUT,
+    edge: float = EDGE_EXCLUSION,
+) -> tuple[gf.Component, dict[str, list[tuple[float, float]]]]:
+    # each design is held once and referenced at its sites, centered on the
+    # site. With layers, each design is reduced to a flat cell of those layers
+    # (e.g. one backside mask). Returns the wafer and the site centers of each
+    # design, by row then column. The marks are only kept clear, no mark geometry
+    # or wafer id is drawn, so the wafer is a site plan rather than a mask
+    sizes = {key: (c.dbbox().width(), c.dbbox().height()) for key, c in designs.items()}
+    errors = check(site_map, sizes, step, radius, marks, keepout, edge)
+    if errors:
+        raise RuntimeError("Wafer site map check failed:\n" + "\n".join(errors))
+
+    wafer = gf.Component(name=name)
+    placements = {}
+    for design in sorted(set(site_map.values())):
+        component = designs[design]
+        cell = component.kdb_cell
+        if layers is not None:
+            reduced = gf.Component(name=f"{name}_{design}")
+            for layer in layers:
+                index = gf.get_layer(layer)
+                reduced.kdb_cell.shapes(index).insert(cell.begin_shapes_rec(index))
+            cell = reduced.kdb_cell
+
+        center = component.dbbox().center()
+        placements[design] = []
+        for column, row in sorted(site_map, key=lambda key: (key[1], key[0])):
+            if site_map[(column, row)] != design:
+                continue
+            x, y = column * step[0], row * step[1]
+            wafer.kdb_cell.insert(
+                kdb.DCellInstArray(
+                    cell.cell_index(), kdb.DTrans(kdb.DPoint(x, y) - center)
+                )
+            )
+            placements[design].append((x, y))
+
+    return wafer, placements
+
+
+def placements_text(
+    step: tuple[float, float],
+    placements: list[tuple[float, float]],
+    diameter: float = WAFER_DIAMETER,
+    marks: list[tuple[float, float]] = WAFER_ALIGNMENT_MARKS,
+) -> str:
+    # stepper job input, chip centers relative to the wafer center
+    text = f"WAFER_DIAMETER: {diameter:.2f}\n"
+    text += f"X_STEP_SIZE: {step[0]:.2f}\n"
+    text += f"Y_STEP_SIZE: {step[1]:.2f}\n"
+    text += f"CHIP_COUNT: {len(placements)}\n"
+    text += f"\n"
+    for mark in marks:
+        text += f"MARK: {mark[0]:.2f}, {mark[1]:.2f}\n"
+    text += f"\n"
+    for placement in placements:
+        text += f"CHIP: {placement[0]:.2f}, {placement[1]:.2f}\n"
+    return text
+
+
+if __name__ == "__main__":
+    from output import FORMATS, write
+    from labels import load as load_layout
+
+    parser = argparse.ArgumentParser(description="Mixed-design wafers for MEGA-PC")
+    parser.add_argument(
+        "sites",
+        help="JSON site map, see wafer.load",
+    )
+    parser.add_argument(
+        "--step",
+        action="store",
+        type=float,
+        nargs=2,
+        help="Site step X Y in um",
+        required=True,
+    )
+    parser.add_argument(
+        "--layer",
+        action="append",
+        type=str,
+        help="Keep only this layer of the designs, can be repeated",
+        default=None,
+    )
+    parser.add_argument(
+        "--output",
+        action="store",
+        type=str,
+        help="Output path without extension, PLACEMENTS files are written next to it",
+        required=True,
+    )
+    parser.add_argument(
+        "--format",
+        action="store",
+        type=str,
+        choices=FORMATS,
+        help="Output format of the wafer file",
+        default="gds",
+    )
+    args = parser.parse_args()
+
+    PDK.activate()
+
+    paths, site_map = load(args.sites)
+    wafer, placements = compose(
+        designs={key: load_layout(path, name=key) for key, path in paths.items()},
+        site_map=site_map,
+        step=tuple(args.step),
+        layers=None if args.layer is None else [LAYERS[key] for key in args.layer],
+    )
+    write(wafer, args.output, format=args.format)
+    for design, centers in placements.items():
+        with open(f"{args.output}_{design}_PLACEMENTS.txt", "w") as f:
+            f.write(placements_text(tuple(args.step), centers))
+        print(f"{design}: {len(centers)} sites")